@@ -0,0 +1,171 @@
+import argparse
+import math
+import time
+import cv2
+import numpy as np
+from tracker import Tracker
+from encoder import FrameEncoder, available_backends
+from speed import SpeedEstimator, get_perspective_transform
+
+# Micro-benchmarks for the hot paths of the backend.
+# Usage: python benchmarks.py [tracker] [encoder] [speed] [--frames N]
+
+
+class LegacyTracker:
+    # The original nested-loop tracker, kept here as the baseline
+    def __init__(self):
+        self.center_points = {}
+        self.id_count = 0
+
+    def update(self, objects_rect):
+        objects_bbs_ids = []
+        for rect in objects_rect:
+            x, y, w, h = rect
+            cx = (x + x + w) // 2
+            cy = (y + y + h) // 2
+
+            same_object_detected = False
+            for id, pt in self.center_points.items():
+                dist = math.hypot(cx - pt[0], cy - pt[1])
+                if dist < 35:
+                    self.center_points[id] = (cx, cy)
+                    objects_bbs_ids.append([x, y, w, h, id])
+                    same_object_detected = True
+                    break
+
+            if same_object_detected is False:
+                self.center_points[self.id_count] = (cx, cy)
+                objects_bbs_ids.append([x, y, w, h, self.id_count])
+                self.id_count += 1
+
+        new_center_points = {}
+        for obj_bb_id in objects_bbs_ids:
+            _, _, _, _, object_id = obj_bb_id
+            new_center_points[object_id] = self.center_points[object_id]
+        self.center_points = new_center_points.copy()
+        return objects_bbs_ids
+
+
+def synthetic_scene(n_objects, n_frames, seed=0):
+    # Boxes moving with constant velocity on a 4K canvas
+    rng = np.random.default_rng(seed)
+    starts = rng.uniform(0, [3600, 2000], size=(n_objects, 2))
+    velocity = rng.uniform(-8, 8, size=(n_objects, 2))
+    size = rng.uniform(30, 120, size=(n_objects, 2))
+    frames = []
+    for t in range(n_frames):
+        tl = starts + velocity * t
+        br = tl + size
+        frames.append(np.hstack([tl, br]).astype(int).tolist())
+    return frames
+
+
+def time_tracker(tracker, frames):
+    started = time.perf_counter()
+    for rects in frames:
+        tracker.update(rects)
+    return (time.perf_counter() - started) / len(frames)
+
+
+def bench_tracker(n_frames):
+    print(f"{'objects':>8} {'legacy ms':>10} {'numpy ms':>10} {'speed-up':>9}")
+    for n_objects in (10, 100, 500):
+        frames = synthetic_scene(n_objects, n_frames)
+        legacy = time_tracker(LegacyTracker(), frames)
+        vectorized = time_tracker(Tracker(), frames)
+        print(f"{n_objects:>8} {legacy * 1000:>10.3f} {vectorized * 1000:>10.3f} {legacy / vectorized:>8.1f}x")
+
+
+def synthetic_frame(width=1920, height=1080, seed=0):
+    # Road-like test image: gradient background, boxes and sensor noise, so
+    # the JPEG sizes are closer to real footage than a flat or random frame
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.dstack([(x + y) / 2, np.broadcast_to(y, (height, width)), np.broadcast_to(x, (height, width))])
+    frame = frame.astype(np.uint8)
+    for _ in range(40):
+        x1, y1 = int(rng.integers(0, width - 200)), int(rng.integers(0, height - 120))
+        color = [int(c) for c in rng.integers(0, 256, 3)]
+        cv2.rectangle(frame, (x1, y1), (x1 + int(rng.integers(60, 200)), y1 + int(rng.integers(40, 120))), color, -1)
+    noise = rng.integers(-8, 9, size=frame.shape, dtype=np.int16)
+    return np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def bench_encoder(n_frames):
+    frame = synthetic_frame()
+    print(f"{'backend':>11} {'quality':>8} {'width':>6} {'fps':>8} {'KB/frame':>9}")
+    for backend in available_backends():
+        for quality, max_width in ((95, 0), (80, 0), (60, 0), (80, 960)):
+            encoder = FrameEncoder(quality, max_width, backend=backend)
+            size = len(encoder.encode(frame))
+            started = time.perf_counter()
+            for _ in range(n_frames):
+                encoder.encode(frame)
+            fps = n_frames / (time.perf_counter() - started)
+            print(f"{backend:>11} {quality:>8} {max_width or frame.shape[1]:>6} {fps:>8.1f} {size / 1024:>9.1f}")
+
+
+class LegacySpeedEstimator:
+    # The original per-vehicle speed loop of speed.py, kept as the baseline
+    def __init__(self, roi_points, distance_meters, fps):
+        self.matrix = get_perspective_transform(None, roi_points)
+        self.distance_meters = distance_meters
+        self.fps = fps
+        self.vehicle_data = {}
+
+    def update(self, tracks, frame_count):
+        vehicle_data = self.vehicle_data
+        speeds = []
+        for x1, y1, x2, y2, obj_id in tracks:
+            cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+            transformed_point = cv2.perspectiveTransform(np.array([[[cx, cy]]], dtype=np.float32), self.matrix)
+            tx, ty = transformed_point[0][0]
+            if obj_id not in vehicle_data:
+                vehicle_data[obj_id] = {'last_x': None, 'last_y': None, 'last_frame': None, 'speeds': [],
+                                        'avg_speed': None}
+            data = vehicle_data[obj_id]
+            if data['last_frame'] is not None and frame_count != data['last_frame']:
+                distance = np.sqrt((tx - data['last_x'])**2 + (ty - data['last_y'])**2)
+                time = (frame_count - data['last_frame']) / self.fps
+                data['speeds'].append((distance / 500) * (self.distance_meters / time) * 3.6)
+                data['avg_speed'] = np.mean(data['speeds'][-5:])
+            data['last_x'], data['last_y'], data['last_frame'] = tx, ty, frame_count
+            speeds.append(data['avg_speed'])
+        return speeds
+
+
+def bench_speed(n_frames):
+    roi_points = np.float32([[800, 400], [3000, 400], [3600, 2100], [200, 2100]])
+    print(f"{'vehicles':>8} {'legacy ms':>10} {'numpy ms':>10} {'speed-up':>9}")
+    for n_vehicles in (50, 200, 1000):
+        frames = [[box + [obj_id] for obj_id, box in enumerate(boxes)]
+                  for boxes in synthetic_scene(n_vehicles, n_frames)]
+        timings = []
+        for estimator in (LegacySpeedEstimator(roi_points, 20, 30.0), SpeedEstimator(roi_points, 20, 30.0)):
+            started = time.perf_counter()
+            for index, tracks in enumerate(frames, 1):
+                estimator.update(tracks, index)
+            timings.append((time.perf_counter() - started) / len(frames))
+        legacy, vectorized = timings
+        print(f"{n_vehicles:>8} {legacy * 1000:>10.3f} {vectorized * 1000:>10.3f} {legacy / vectorized:>8.1f}x")
+
+
+BENCHMARKS = {
+    'tracker': bench_tracker,
+    'encoder': bench_encoder,
+    'speed': bench_speed,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backend micro-benchmarks")
+    parser.add_argument('names', nargs='*', help=f"any of: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--frames', type=int, default=100)
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    for name in args.names or list(BENCHMARKS):
+        print(f"== {name} ==")
+        BENCHMARKS[name](args.frames)
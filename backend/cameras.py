@@ -0,0 +1,233 @@
+import time
+import threading
+import logging
+from collections import deque
+import cv2
+from pipeline import FramePacket
+import config
+
+logger = logging.getLogger(__name__)
+
+# One reader thread per camera URL. It decodes every frame once, keeps the
+# latest one for snapshots and fans it out to every analysis subscribed to
+# the camera. Lost connections are reopened with exponential backoff; the
+# subscribers simply wait for frames to resume. A camera without subscribers
+# is closed after CAMERA_IDLE_TIMEOUT seconds.
+
+
+def camera_url(ip, port):
+    return f"http://{ip}:{port}/video"
+
+
+class Subscription:
+    # Frames of one camera for one consumer. The buffer is small and drops the
+    # oldest frame when full, so a slow analysis never stalls the reader or
+    # the other subscribers.
+    def __init__(self, camera, maxsize):
+        self.camera = camera
+        self.frames = deque(maxlen=maxsize)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self.cond:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(item)
+            self.cond.notify()
+
+    def get(self, timeout):
+        # Next (frame, seq, captured), or None on timeout / once closed. Frames
+        # are shared with the other subscribers and the snapshot cache: copy
+        # before drawing.
+        with self.cond:
+            self.cond.wait_for(lambda: self.frames or self.closed, timeout)
+            if self.closed or not self.frames:
+                return None
+            return self.frames.popleft()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.camera.unsubscribe(self)
+
+
+class Camera:
+    def __init__(self, url, manager):
+        self.url = url
+        self.manager = manager
+        self.lock = threading.Condition()
+        self.subscribers = set()
+        self.latest = None
+        self.latest_time = None
+        self.frames_read = 0
+        self.reconnects = 0
+        self.last_active = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name=f"camera {url}", daemon=True)
+
+    def subscribe(self, maxsize):
+        subscription = Subscription(self, maxsize)
+        with self.lock:
+            self.subscribers.add(subscription)
+            self.last_active = time.monotonic()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+            self.last_active = time.monotonic()
+
+    def wait_latest(self, timeout):
+        # Latest decoded frame, waiting up to timeout for the first one
+        with self.lock:
+            self.last_active = time.monotonic()
+            self.lock.wait_for(lambda: self.latest is not None, timeout)
+            return self.latest
+
+    def idle(self):
+        with self.lock:
+            return not self.subscribers and time.monotonic() - self.last_active > config.CAMERA_IDLE_TIMEOUT
+
+    def _publish(self, frame, captured):
+        with self.lock:
+            self.latest = frame
+            self.latest_time = time.time()
+            self.frames_read += 1
+            item = (frame, self.frames_read, captured)
+            subscribers = list(self.subscribers)
+            self.lock.notify_all()
+        for subscription in subscribers:
+            subscription.put(item)
+
+    def _run(self):
+        backoff = config.CAMERA_RECONNECT_MIN
+        while not self.manager.retire_if_idle(self):
+            cap = cv2.VideoCapture(self.url)
+            if not cap.isOpened():
+                cap.release()
+                logger.warning(f"Camera {self.url} unavailable, retrying in {backoff:.1f}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, config.CAMERA_RECONNECT_MAX)
+                continue
+
+            logger.info(f"Camera {self.url} connected")
+            backoff = config.CAMERA_RECONNECT_MIN
+            try:
+                while True:
+                    ret, frame = cap.read()
+                    captured = time.monotonic()
+                    if not ret:
+                        logger.warning(f"Camera {self.url} stream lost, reconnecting")
+                        self.reconnects += 1
+                        break
+                    self._publish(frame, captured)
+                    if self.frames_read % 100 == 0 and self.idle():
+                        break
+            finally:
+                cap.release()
+        logger.info(f"Camera {self.url} closed after {self.frames_read} frames")
+
+
+class CameraManager:
+    def __init__(self):
+        self.cameras = {}
+        self.lock = threading.Lock()
+
+    def _camera(self, url):
+        # Running camera for the URL, started on first use
+        with self.lock:
+            camera = self.cameras.get(url)
+            if camera is None:
+                camera = Camera(url, self)
+                self.cameras[url] = camera
+                camera.thread.start()
+            camera.last_active = time.monotonic()
+            return camera
+
+    def retire_if_idle(self, camera):
+        # Called by the reader thread; decided under the manager lock so a
+        # concurrent subscribe either sees the camera running or starts anew
+        with self.lock:
+            if not camera.idle():
+                return False
+            if self.cameras.get(camera.url) is camera:
+                del self.cameras[camera.url]
+            return True
+
+    def subscribe(self, url, maxsize=None):
+        return self._camera(url).subscribe(maxsize or config.CAMERA_BUFFER)
+
+    def snapshot(self, url, timeout=None):
+        # Latest cached frame of the camera (read-only), or None
+        camera = self._camera(url)
+        return camera.wait_latest(config.CAMERA_CONNECT_TIMEOUT if timeout is None else timeout)
+
+    def stats(self):
+        with self.lock:
+            return {url: {'subscribers': len(c.subscribers), 'frames': c.frames_read, 'reconnects': c.reconnects}
+                    for url, c in self.cameras.items()}
+
+
+camera_manager = CameraManager()
+
+
+class CameraSource:
+    # Pipeline source over a shared camera: yields FramePackets until the
+    # pipeline stops it. Fails if the camera delivers nothing within
+    # CAMERA_CONNECT_TIMEOUT of subscribing; later outages are waited out.
+    # With latest=True only the newest unread frame is kept. Packet indexes
+    # count the camera's frames since subscribing, so skipped frames leave
+    # gaps.
+    def __init__(self, url, latest=False, manager=None):
+        self.url = url
+        self.subscription = (manager or camera_manager).subscribe(url, 1 if latest else None)
+        self.first_seq = None
+        self.first_captured = None
+        self.index = 0
+        self.started = time.monotonic()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            item = self.subscription.get(timeout=0.5)
+            if item is not None:
+                frame, seq, captured = item
+                if self.first_seq is None:
+                    self.first_seq = seq
+                    self.first_captured = captured
+                self.index = seq - self.first_seq + 1
+                # Own copy: the annotate stage draws on it. Live frames are
+                # stamped with their capture time since subscribing.
+                return FramePacket(self.index, frame.copy(), captured, captured - self.first_captured)
+            if self.subscription.closed:
+                raise StopIteration
+            if self.index == 0 and time.monotonic() - self.started > config.CAMERA_CONNECT_TIMEOUT:
+                self.stop()
+                raise ConnectionError(f"Error opening video stream from {self.url}")
+
+    def stop(self):
+        if not self.subscription.closed:
+            self.subscription.close()
+
+    close = stop
+
+
+class LiveStats:
+    # Stage fn for live pipelines, placed right before formatting: adds
+    # {'dropped', 'latency_ms'} to the payload, i.e. camera frames the client
+    # did not get so far (skipped for detection or preview) and the time from
+    # reading this frame off the camera until it was annotated and encoded
+    def __init__(self):
+        self.processed = 0
+
+    def __call__(self, packet):
+        self.processed += 1
+        packet.payload['live'] = {
+            'dropped': packet.index - self.processed,
+            'latency_ms': round((time.monotonic() - packet.captured) * 1000, 1),
+        }
+        return packet
@@ -0,0 +1,119 @@
+import os
+
+# Runtime settings, overridable through environment variables so a deployment
+# can switch YOLO variants without touching the code.
+
+# Weights used when a feature does not ask for a specific model
+DEFAULT_MODEL = os.getenv("TA_MODEL", "yolov9c.pt")
+
+# Per-feature weights (fall back to the historical choices of each module)
+COUNT_MODEL = os.getenv("TA_COUNT_MODEL", os.getenv("TA_MODEL", "yolov9c.pt"))
+LANE_MODEL = os.getenv("TA_LANE_MODEL", os.getenv("TA_MODEL", "yolov8l.pt"))
+SPEED_MODEL = os.getenv("TA_SPEED_MODEL", os.getenv("TA_MODEL", "yolov8l.pt"))
+
+# Load and warm up every configured model when the FastAPI app starts.
+# Set TA_PRELOAD_MODELS=0 to load lazily on first use instead.
+PRELOAD_MODELS = os.getenv("TA_PRELOAD_MODELS", "1") == "1"
+
+# Size of the dummy frame pushed through each model during warm-up
+WARMUP_IMAGE_SIZE = int(os.getenv("TA_WARMUP_IMAGE_SIZE", "640"))
+
+
+def configured_models():
+    # Unique weights files referenced by the configuration, in a stable order
+    return list(dict.fromkeys([COUNT_MODEL, LANE_MODEL, SPEED_MODEL]))
+
+# Batched inference for uploaded files: number of decoded frames sent to the
+# detector in one call, and the longest time (seconds) to wait for a batch to
+# fill before running it anyway.
+BATCH_SIZE = int(os.getenv("TA_BATCH_SIZE", "8"))
+BATCH_MAX_WAIT = float(os.getenv("TA_BATCH_MAX_WAIT", "0.05"))
+
+# Maximum number of model calls running at the same time across all sessions
+INFERENCE_WORKERS = int(os.getenv("TA_INFERENCE_WORKERS", "2"))
+
+# Number of finished results a session may buffer ahead of a slow client
+STREAM_QUEUE_SIZE = int(os.getenv("TA_STREAM_QUEUE_SIZE", "4"))
+
+# Capacity of the queues between pipeline stages (decode -> detect -> track ->
+# annotate -> encode); a full queue blocks the upstream stage
+PIPELINE_QUEUE_SIZE = int(os.getenv("TA_PIPELINE_QUEUE_SIZE", "8"))
+
+# Seconds between per-stage throughput log lines (0 disables periodic logs)
+PIPELINE_STATS_INTERVAL = float(os.getenv("TA_PIPELINE_STATS_INTERVAL", "10"))
+
+# Tracker persistence: frames an unmatched track survives (0 drops IDs as soon
+# as a detection is missed) and the gate (px) used to re-associate lost tracks
+# around their constant-velocity predicted position
+TRACK_MAX_LOST = int(os.getenv("TA_TRACK_MAX_LOST", "5"))
+TRACK_LOST_GATE = float(os.getenv("TA_TRACK_LOST_GATE", "50"))
+
+# ROI-cropped inference for the ROI-based features (/Wrong, /Lane_ip, /Speed):
+# send only the ROI's bounding box, grown by CROP_PADDING px, to the detector
+CROP_TO_ROI = os.getenv("TA_CROP_TO_ROI", "0") == "1"
+CROP_PADDING = int(os.getenv("TA_CROP_PADDING", "32"))
+
+# Preview frames sent to the client: at most PREVIEW_FPS per second (0 sends
+# every analyzed frame) and at most PREVIEW_MAX_WIDTH px wide (0 keeps the
+# source resolution). Analysis always runs on every frame.
+PREVIEW_FPS = float(os.getenv("TA_PREVIEW_FPS", "0"))
+PREVIEW_MAX_WIDTH = int(os.getenv("TA_PREVIEW_MAX_WIDTH", "0"))
+
+# JPEG encoding of preview frames and snapshots: quality (1-100) and codec.
+# TA_JPEG_BACKEND=auto picks simplejpeg or PyTurboJPEG when installed and
+# OpenCV otherwise; simplejpeg, turbojpeg or opencv force one.
+JPEG_QUALITY = int(os.getenv("TA_JPEG_QUALITY", "80"))
+JPEG_BACKEND = os.getenv("TA_JPEG_BACKEND", "auto")
+
+# Offline jobs (POST /jobs): number of videos processed at the same time
+JOB_WORKERS = int(os.getenv("TA_JOB_WORKERS", "1"))
+
+# Worker-pool mode: run every analysis session in one of WORKER_PROCESSES
+# separate processes (0 keeps everything in the server process), optionally
+# pinning each worker to its own share of the CPUs
+WORKER_PROCESSES = int(os.getenv("TA_WORKER_PROCESSES", "0"))
+WORKER_PIN_CPUS = os.getenv("TA_WORKER_PIN_CPUS", "0") == "1"
+
+# Seconds an idle client session (uploaded video, live line settings) is
+# kept before it is forgotten; 0 keeps sessions forever
+SESSION_TTL = float(os.getenv("TA_SESSION_TTL", "86400"))
+
+# Live cameras: frames buffered per subscribed analysis (the oldest is dropped
+# when it is full), reconnect backoff bounds (seconds), how long to wait for
+# a camera's first frame, and how long a camera without subscribers stays
+# open for snapshots
+CAMERA_BUFFER = int(os.getenv("TA_CAMERA_BUFFER", "2"))
+CAMERA_RECONNECT_MIN = float(os.getenv("TA_CAMERA_RECONNECT_MIN", "0.5"))
+CAMERA_RECONNECT_MAX = float(os.getenv("TA_CAMERA_RECONNECT_MAX", "30"))
+CAMERA_CONNECT_TIMEOUT = float(os.getenv("TA_CAMERA_CONNECT_TIMEOUT", "10"))
+CAMERA_IDLE_TIMEOUT = float(os.getenv("TA_CAMERA_IDLE_TIMEOUT", "30"))
+
+# Live streams analyze only the newest camera frame (1): frames that arrive
+# while a frame is still being analyzed are skipped, which keeps latency
+# bounded when inference is slower than the camera. 0 analyzes every frame
+# the camera buffer holds.
+LIVE_LATEST_FRAME = os.getenv("TA_LIVE_LATEST_FRAME", "1") == "1"
+
+# Uploaded videos: directory (served to the frontend for snapshots) and the
+# block size uploads are written and hashed in
+UPLOAD_DIR = os.getenv("TA_UPLOAD_DIR", "uploads")
+UPLOAD_CHUNK_SIZE = int(os.getenv("TA_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+
+# Persistent cache of per-frame detections and final results of uploaded
+# videos (see result_cache.py); least recently used files are deleted once
+# it exceeds CACHE_MAX_BYTES, 0 disables the cache
+CACHE_DIR = os.getenv("TA_CACHE_DIR", "cache")
+CACHE_MAX_BYTES = int(os.getenv("TA_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# Start an 'index' job for every new upload: decode it once and store the
+# detection index of each configured model, so later analyses without drawn
+# frames (metadata output, jobs) neither decode nor run inference
+INDEX_ON_UPLOAD = os.getenv("TA_INDEX_ON_UPLOAD", "0") == "1"
+
+# Speed and wrong-way analyses: frames after which a vehicle that is no longer
+# tracked is forgotten, and how many of its latest speed samples are averaged
+VEHICLE_MAX_AGE = int(os.getenv("TA_VEHICLE_MAX_AGE", "30"))
+SPEED_HISTORY = int(os.getenv("TA_SPEED_HISTORY", "5"))
+# Per-vehicle speed filter: 'ema' (exponential moving average spanning
+# SPEED_HISTORY samples) or 'window' (mean of the last SPEED_HISTORY samples)
+SPEED_FILTER = os.getenv("TA_SPEED_FILTER", "ema")
@@ -0,0 +1,101 @@
+import numpy as np
+
+# Directions reported for a crossing, relative to the line drawn from
+# (startX, startY) to (endX, endY) as it appears on screen: 'right' when the
+# vehicle ends up on the right-hand side of that vector, 'left' otherwise.
+# With image coordinates (y pointing down) a non-negative cross product means
+# the right-hand side, so the index is the boolean side test.
+DIRECTIONS = ('left', 'right')
+# Updates a track may go unseen before its last position is forgotten
+MAX_AGE = 30
+
+
+def _cross(ax, ay, bx, by):
+    return ax * by - ay * bx
+
+
+class CrossingEngine:
+    def __init__(self, lines, max_age=MAX_AGE):
+        self.set_lines(lines)
+        # Last known center of every track, and the update it was seen in
+        self.previous = {}
+        self.max_age = max_age
+        self.frame = 0
+
+    def set_lines(self, lines):
+        # Line geometry is computed once: start points and direction vectors.
+        # Replacing the lines restarts the counts but keeps the track history,
+        # so crossings of the new lines are detected from the next update.
+        self.starts = np.array([[line['startX'], line['startY']] for line in lines], dtype=np.float64).reshape(-1, 2)
+        self.ends = np.array([[line['endX'], line['endY']] for line in lines], dtype=np.float64).reshape(-1, 2)
+        self.vectors = self.ends - self.starts
+        # Unique IDs counted per line, plus per-direction totals
+        self.counters = [set() for _ in range(len(self.starts))]
+        self.direction_counts = np.zeros((len(self.starts), 2), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def endpoints(self):
+        # Integer (start, end) pairs for drawing
+        return [((int(sx), int(sy)), (int(ex), int(ey)))
+                for (sx, sy), (ex, ey) in zip(self.starts.tolist(), self.ends.tolist())]
+
+    def counts(self):
+        return [len(counter) for counter in self.counters]
+
+    def update(self, tracks):
+        # tracks: [[x1, y1, x2, y2, id], ...]. Tests the segment from each
+        # track's previous center to its current one against every line in
+        # one pass and returns the new crossings as
+        # (line_index, obj_id, direction, cx, cy).
+        self.frame += 1
+        crossings = []
+        if not tracks:
+            self._evict()
+            return crossings
+
+        boxes = np.asarray([t[:4] for t in tracks], dtype=np.float64)
+        ids = [t[4] for t in tracks]
+        current = (boxes[:, :2] + boxes[:, 2:]) // 2
+
+        known = [i for i, obj_id in enumerate(ids) if obj_id in self.previous]
+        if known and len(self.starts):
+            q = current[known]
+            p = np.array([self.previous[ids[i]][0] for i in known], dtype=np.float64)
+
+            # Side of each line before and after the move (K x L)
+            sx, sy = self.starts[None, :, 0], self.starts[None, :, 1]
+            vx, vy = self.vectors[None, :, 0], self.vectors[None, :, 1]
+            side_p = _cross(vx, vy, p[:, 0, None] - sx, p[:, 1, None] - sy) >= 0
+            side_q = _cross(vx, vy, q[:, 0, None] - sx, q[:, 1, None] - sy) >= 0
+
+            # The line's end points must lie on opposite sides of the movement
+            mx, my = (q - p)[:, 0, None], (q - p)[:, 1, None]
+            d_start = _cross(mx, my, sx - p[:, 0, None], sy - p[:, 1, None])
+            d_end = _cross(mx, my, self.ends[None, :, 0] - p[:, 0, None], self.ends[None, :, 1] - p[:, 1, None])
+
+            crossed = (side_p != side_q) & (d_start * d_end <= 0)
+            for k, line_idx in zip(*np.nonzero(crossed)):
+                obj_id = ids[known[k]]
+                if obj_id in self.counters[line_idx]:
+                    continue
+                direction = int(side_q[k, line_idx])
+                self.counters[line_idx].add(obj_id)
+                self.direction_counts[line_idx, direction] += 1
+                cx, cy = q[k].astype(int).tolist()
+                crossings.append((int(line_idx), obj_id, DIRECTIONS[direction], cx, cy))
+
+        for obj_id, center in zip(ids, current.tolist()):
+            self.previous[obj_id] = (center, self.frame)
+        self._evict()
+        return crossings
+
+    def _evict(self):
+        # Forget tracks that have not been seen for max_age updates
+        stale = [obj_id for obj_id, (_, seen) in self.previous.items() if self.frame - seen > self.max_age]
+        for obj_id in stale:
+            del self.previous[obj_id]
+
+    def direction_summary(self):
+        return [dict(zip(DIRECTIONS, row)) for row in self.direction_counts.tolist()]
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+from pipeline import FramePacket
+
+# Columnar detection index of one video for one detector: every box the
+# model found, sorted by frame, as one .npy file per column in a directory.
+#   frame.npy    int32    1-based frame index of each box
+#   box.npy      float32  (n, 4) x1, y1, x2, y2
+#   cls.npy      int16    class id
+#   conf.npy     float32  confidence
+#   offsets.npy  int64    (frames + 1) start of each frame's rows
+#   detected.npy bool     (frames) False for frames skipped by detect_stride
+#   timestamp.npy float64 (frames) presentation time of each frame (seconds);
+#                         absent in indexes written before it was added
+# Columns are memory-mapped on open, so opening an index costs nothing and
+# only the pages of the frames actually read are loaded. Analyses that do not
+# draw run straight from an index without decoding the video.
+
+COLUMNS = ('frame', 'box', 'cls', 'conf', 'offsets', 'detected')
+OPTIONAL_COLUMNS = ('timestamp',)
+
+
+def write_index(path, frames, timestamps=None):
+    # frames: per-frame detection arrays in BatchDetector layout (rows of
+    # x1, y1, x2, y2, conf, class_id), None for frames that were not detected.
+    # timestamps: per-frame presentation times, stored when all are known.
+    os.makedirs(path, exist_ok=True)
+    counts = np.array([0 if d is None else len(d) for d in frames], dtype=np.int64)
+    present = [d for d in frames if d is not None and len(d)]
+    rows = np.concatenate(present).astype(np.float32) if present else np.zeros((0, 6), dtype=np.float32)
+    columns = {
+        'frame': np.repeat(np.arange(1, len(frames) + 1, dtype=np.int32), counts),
+        'box': rows[:, :4],
+        'cls': rows[:, 5].astype(np.int16),
+        'conf': rows[:, 4],
+        'offsets': np.concatenate([[0], np.cumsum(counts)]),
+        'detected': np.array([d is not None for d in frames], dtype=bool),
+    }
+    if timestamps is not None and None not in timestamps:
+        columns['timestamp'] = np.asarray(timestamps, dtype=np.float64)
+    for name, column in columns.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(column))
+    return len(rows)
+
+
+class DetectionIndex:
+    def __init__(self, path):
+        self.path = path
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r'))
+        for name in OPTIONAL_COLUMNS:
+            column_path = os.path.join(path, f"{name}.npy")
+            setattr(self, name, np.load(column_path, mmap_mode='r') if os.path.exists(column_path) else None)
+
+    def __len__(self):
+        return len(self.detected)
+
+    @property
+    def boxes(self):
+        return len(self.frame)
+
+    def detections(self, index):
+        # Detections of a 1-based frame in BatchDetector layout; None when the
+        # frame was skipped by the detect stride
+        if not self.detected[index - 1]:
+            return None
+        start, end = self.offsets[index - 1], self.offsets[index]
+        rows = np.empty((end - start, 6), dtype=np.float32)
+        rows[:, :4] = self.box[start:end]
+        rows[:, 4] = self.conf[start:end]
+        rows[:, 5] = self.cls[start:end]
+        return rows
+
+
+    def frame_time(self, index, fps):
+        # Stored presentation time of a 1-based frame, or the nominal one
+        if self.timestamp is not None:
+            return float(self.timestamp[index - 1])
+        return (index - 1) / fps if fps else None
+
+
+def index_source(index, fps=None):
+    # Decode-free pipeline source: packets without a frame that already
+    # carry their detections
+    for i in range(1, len(index) + 1):
+        packet = FramePacket(i, None, timestamp=index.frame_time(i, fps))
+        packet.detections = index.detections(i)
+        yield packet
@@ -0,0 +1,107 @@
+import logging
+import cv2
+import numpy as np
+import config
+
+logger = logging.getLogger(__name__)
+
+# Optional faster JPEG codecs; OpenCV is always available as the fallback
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    _turbojpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    # Missing bindings or missing libturbojpeg shared library
+    _turbojpeg = None
+
+
+# All backends use 4:2:0 chroma subsampling like OpenCV's default, so the
+# output size only depends on the quality setting
+def _encode_simplejpeg(frame, quality):
+    return simplejpeg.encode_jpeg(frame, quality=quality, colorspace='BGR', colorsubsampling='420')
+
+
+def _encode_turbojpeg(frame, quality):
+    return _turbojpeg.encode(frame, quality=quality, jpeg_subsample=TJSAMP_420)
+
+
+def _encode_opencv(frame, quality):
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return buffer.tobytes()
+
+
+BACKENDS = {
+    'simplejpeg': _encode_simplejpeg,
+    'turbojpeg': _encode_turbojpeg,
+    'opencv': _encode_opencv,
+}
+
+
+def available_backends():
+    # Installed backends, fastest first
+    names = []
+    if simplejpeg is not None:
+        names.append('simplejpeg')
+    if _turbojpeg is not None:
+        names.append('turbojpeg')
+    names.append('opencv')
+    return names
+
+
+def default_backend():
+    backend = config.JPEG_BACKEND
+    if backend == 'auto':
+        return available_backends()[0]
+    if backend not in available_backends():
+        logger.warning(f"JPEG backend '{backend}' is not available, falling back to OpenCV")
+        return 'opencv'
+    return backend
+
+
+class FrameEncoder:
+    # JPEG encoder for one session: fixed quality, optional downscale to
+    # max_width, and a resize/contiguity buffer that is reused from frame to
+    # frame. Not thread-safe; each encode stage owns its own instance.
+    def __init__(self, quality=None, max_width=None, backend=None):
+        self.quality = config.JPEG_QUALITY if quality is None else int(quality)
+        if not 1 <= self.quality <= 100:
+            raise ValueError("JPEG quality must be between 1 and 100")
+        self.max_width = int(max_width or 0)
+        self.backend = backend or default_backend()
+        self._encode = BACKENDS[self.backend]
+        self._buffer = None
+
+    def _reuse(self, shape, dtype):
+        if self._buffer is None or self._buffer.shape != shape or self._buffer.dtype != dtype:
+            self._buffer = np.empty(shape, dtype=dtype)
+        return self._buffer
+
+    def prepare(self, frame):
+        # Downscaled (aspect ratio kept) and C-contiguous view of the frame
+        height, width = frame.shape[:2]
+        if self.max_width and width > self.max_width:
+            size = (self.max_width, max(1, round(height * self.max_width / width)))
+            out = self._reuse((size[1], size[0]) + frame.shape[2:], frame.dtype)
+            return cv2.resize(frame, size, dst=out, interpolation=cv2.INTER_AREA)
+        if not frame.flags['C_CONTIGUOUS']:
+            out = self._reuse(frame.shape, frame.dtype)
+            np.copyto(out, frame)
+            return out
+        return frame
+
+    def encode(self, frame):
+        # BGR frame -> JPEG bytes
+        return self._encode(self.prepare(frame), self.quality)
+
+    def encode_packet(self, packet):
+        # Encode stage: JPEG-encode the annotated frame; formatting for the
+        # wire happens in the transport's format stage
+        packet.jpeg = self.encode(packet.frame)
+        packet.frame = None
+        return packet
@@ -0,0 +1,171 @@
+import time
+import numpy as np
+from model_registry import predict
+from workers import run_inference
+from pipeline import Stage, BatchStage
+import config
+
+EMPTY_DETECTIONS = np.zeros((0, 6), dtype=np.float32)
+
+
+def detections_from_result(result):
+    # Rows of [x1, y1, x2, y2, conf, class_id]
+    data = result.boxes.data
+    if len(data) == 0:
+        return EMPTY_DETECTIONS
+    return data.detach().cpu().numpy()
+
+
+class BatchDetector:
+    def __init__(self, weights, batch_size=None, max_wait=None, detect_stride=1, roi=None, crop_padding=0,
+                 cache=None):
+        self.weights = weights
+        self.batch_size = max(1, int(batch_size or config.BATCH_SIZE))
+        self.max_wait = config.BATCH_MAX_WAIT if max_wait is None else float(max_wait)
+        # Run the model on every Nth frame only; the tracker propagates boxes
+        # on the frames in between
+        self.detect_stride = max(1, int(detect_stride or 1))
+        # Optional CompiledROI: frames are cropped to its padded bounding box
+        # before inference and boxes are shifted back to frame coordinates
+        self.roi = roi
+        self.crop_padding = crop_padding
+        # Optional result_cache.DetectionCache: frames it holds are not
+        # inferred again, new results are recorded into it
+        self.cache = cache
+        self.frames_seen = 0
+        self.frames_inferred = 0
+        # Detected frames served from the detection cache instead of the model
+        self.frames_replayed = 0
+        self.started = None
+        # Presentation times of the first and latest packet seen
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def detect(self, frames):
+        # One model call for the whole batch; results come back in input order
+        if not frames:
+            return []
+        results = run_inference(predict, list(frames), self.weights)
+        return [detections_from_result(r) for r in results]
+
+    def _crop(self, frame):
+        x1, y1, x2, y2 = self.roi.crop_rect(frame.shape, self.crop_padding)
+        return np.ascontiguousarray(frame[y1:y2, x1:x2]), (x1, y1)
+
+    def detect_frames(self, frames):
+        if not frames:
+            return []
+        if self.roi is None:
+            return self.detect(frames)
+        crops, offsets = zip(*(self._crop(frame) for frame in frames))
+        # An ROI outside the frame leaves an empty crop: nothing to detect
+        detected = iter(self.detect([crop for crop in crops if crop.size]))
+        results = []
+        for crop, (dx, dy) in zip(crops, offsets):
+            detections = next(detected) if crop.size else EMPTY_DETECTIONS
+            if len(detections):
+                detections = detections.copy()
+                detections[:, [0, 2]] += dx
+                detections[:, [1, 3]] += dy
+            results.append(detections)
+        return results
+
+    def settings(self):
+        # Everything that changes the detections of a given frame
+        return {
+            'weights': self.weights,
+            'detect_stride': self.detect_stride,
+            'crop': None if self.roi is None else [self.roi.bounds, self.crop_padding],
+        }
+
+    def should_detect(self, packet):
+        return (packet.index - 1) % self.detect_stride == 0
+
+    def media_seconds(self):
+        # Span of video or stream time covered so far, from the packets'
+        # presentation timestamps: counts frames dropped or skipped upstream
+        # that frames_seen misses
+        if self.first_timestamp is None:
+            return 0.0
+        return self.last_timestamp - self.first_timestamp
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.started if self.started is not None else 0.0
+        if elapsed <= 0:
+            return {'detect_stride': self.detect_stride, 'inference_fps': 0.0, 'replayed_fps': 0.0,
+                    'output_fps': 0.0, 'media_seconds': 0.0, 'realtime_factor': 0.0}
+        media_seconds = self.media_seconds()
+        return {
+            'detect_stride': self.detect_stride,
+            'inference_fps': round(self.frames_inferred / elapsed, 2),
+            'replayed_fps': round(self.frames_replayed / elapsed, 2),
+            'output_fps': round(self.frames_seen / elapsed, 2),
+            'media_seconds': round(media_seconds, 3),
+            # Seconds of video analyzed per second of wall time
+            'realtime_factor': round(media_seconds / elapsed, 2),
+        }
+
+    def _start(self, packets):
+        if self.started is None:
+            self.started = time.monotonic()
+        for packet in packets:
+            if packet.timestamp is not None:
+                if self.first_timestamp is None:
+                    self.first_timestamp = packet.timestamp
+                self.last_timestamp = packet.timestamp
+
+    def _report(self, packets):
+        self.frames_seen += len(packets)
+        throughput = self.throughput()
+        for packet in packets:
+            packet.payload['throughput'] = throughput
+
+    def detect_packets(self, packets):
+        # Packets skipped by the stride keep detections=None
+        self._start(packets)
+        selected = [p for p in packets if self.should_detect(p)]
+        if self.cache is not None and self.cache.hit:
+            self.frames_replayed += len(selected)
+            pending = []
+            for packet in selected:
+                found, detections = self.cache.lookup(packet.index)
+                if found:
+                    packet.detections = detections
+                else:
+                    pending.append(packet)
+            selected = pending
+            self.frames_replayed -= len(pending)
+        if selected:
+            for packet, detections in zip(selected, self.detect_frames([p.frame for p in selected])):
+                packet.detections = detections
+        if self.cache is not None:
+            for packet in packets:
+                self.cache.record(packet.index, packet.detections, packet.timestamp)
+        self.frames_inferred += len(selected)
+        self._report(packets)
+        return packets
+
+    def replay_packet(self, packet):
+        # Packets from the detection index already carry detections; the
+        # full-frame index holds every frame, so the stride is applied here
+        self._start([packet])
+        if self.should_detect(packet):
+            self.frames_replayed += packet.detections is not None
+        else:
+            packet.detections = None
+        self._report([packet])
+        return packet
+
+    def replay_stage(self, name='detect'):
+        # Stand-in for stage() when packets come from index_source()
+        return Stage(name, self.replay_packet)
+
+    def stage(self, latest=False, name='detect'):
+        # Detect stage for a Pipeline: batches packets by size and wait time.
+        # latest=True detects only the newest frame waiting (live streams).
+        return BatchStage(name, self.detect_packets, self.batch_size, self.max_wait, latest, self.finish)
+
+    def finish(self):
+        if self.cache is not None:
+            self.cache.finish()
+
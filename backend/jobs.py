@@ -0,0 +1,246 @@
+import os
+import time
+import uuid
+import threading
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from options import AnalysisOptions, PACKETS
+from pipeline import Pipeline, capture_source
+from track import CountAnalyzer, build_count_pipeline
+import crossing
+from Lane import WrongLaneAnalyzer, build_lane_pipeline
+from speed import SpeedAnalyzer, build_speed_pipeline
+from video_store import video_store
+from result_cache import result_cache, cache_key
+from process_pool import session_iterator
+import config
+
+logger = logging.getLogger(__name__)
+
+# Offline analysis of uploaded videos. A job runs the same detect/track
+# pipeline as the streaming endpoints but without any output stages, so it
+# goes as fast as decoding and inference allow and does not depend on a
+# connected client. Jobs and their results live in memory. 'index' jobs only
+# preprocess a video: they write its detection indexes so that later
+# analyses without drawn frames skip decoding and inference. In worker-pool
+# mode the analysis itself runs in a pool worker like any streaming session.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+MODES = ('count', 'wrong', 'speed', 'index')
+# Seconds between progress messages of a running job
+PROGRESS_INTERVAL = 0.5
+MODELS = {'count': config.COUNT_MODEL, 'wrong': config.LANE_MODEL, 'speed': config.SPEED_MODEL}
+# Request keys that change the final result of each mode
+RESULT_KEYS = {'count': ('lines',), 'wrong': ('roi', 'greenLine', 'redLine'), 'speed': ('roi', 'distance')}
+
+
+def validate(mode, params):
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {', '.join(MODES)}")
+    if mode == 'count' and not params.get('lines'):
+        raise ValueError("No lines provided")
+    if mode == 'wrong' and (not params.get('roi') or not params.get('greenLine') or not params.get('redLine')):
+        raise ValueError("Missing required data")
+    if mode == 'speed' and (not params.get('roi') or not params.get('distance')):
+        raise ValueError("Missing required data")
+    # Fail on bad tuning options now rather than in the background
+    AnalysisOptions.from_request(params, output=PACKETS)
+
+
+def result_key(mode, params, video, options):
+    # Cache key of a job's final result, or None for videos without a hash
+    if mode not in RESULT_KEYS or not video.get('hash'):
+        return None
+    detection = {'detect_stride': options.detect_stride, 'crop_roi': options.crop_roi,
+                 'crop_padding': options.crop_padding}
+    analysis = {key: params.get(key) for key in RESULT_KEYS[mode]}
+    return cache_key('result', video['hash'], mode, MODELS[mode], detection, analysis, analysis_settings(mode))
+
+
+def analysis_settings(mode):
+    # Server-side tracker and filter settings that change a mode's result
+    settings = {'track_max_lost': config.TRACK_MAX_LOST, 'track_lost_gate': config.TRACK_LOST_GATE}
+    if mode == 'count':
+        settings['crossing_max_age'] = crossing.MAX_AGE
+    else:
+        settings['vehicle_max_age'] = config.VEHICLE_MAX_AGE
+    if mode == 'speed':
+        settings.update(speed_history=config.SPEED_HISTORY, speed_filter=config.SPEED_FILTER)
+    return settings
+
+
+class IndexBuilder:
+    # Analyzer of an 'index' job: one decode pass feeds a detect stage per
+    # configured model, each of which stores its full-frame detection index
+    # in the result cache at the end. Models already indexed are skipped.
+    def __init__(self, video, options):
+        if not video.get('hash') or not result_cache.enabled:
+            raise ValueError("Detection indexes need a stored upload and the result cache")
+        self.detectors = [options.batch_detector(weights, video=video) for weights in config.configured_models()]
+        self.pending = [d for d in self.detectors if not d.cache.hit]
+
+    def pipeline(self, cap, name):
+        if not self.pending:
+            cap.release()
+            return Pipeline([], [], name=name)
+        stages = [d.stage(name=f"detect {d.weights}") for d in self.pending]
+        return Pipeline(capture_source(cap), stages, name=name)
+
+    def summary(self):
+        return {'models': [d.weights for d in self.detectors],
+                'already_indexed': [d.weights for d in self.detectors if d not in self.pending]}
+
+
+def _build(mode, params, cap, video, options, name):
+    # (analyzer, pipeline) for one job
+    if mode == 'index':
+        # Every frame, full frames: the index then serves any stride and ROI
+        builder = IndexBuilder(video, AnalysisOptions.from_request(params, output=PACKETS, detect_stride=1,
+                                                                   crop_roi=False))
+        return builder, builder.pipeline(cap, name)
+    if mode == 'count':
+        analyzer = CountAnalyzer(params['lines'])
+        return analyzer, build_count_pipeline(cap, analyzer, options, name, video)
+    if mode == 'wrong':
+        analyzer = WrongLaneAnalyzer(params['roi'], params['greenLine'], params['redLine'])
+        batch_detector = options.batch_detector(config.LANE_MODEL, roi=analyzer.roi, video=video)
+        source, detect = options.detection_source(cap, batch_detector)
+        return analyzer, build_lane_pipeline(source, detect, analyzer, options, name)
+    roi_points = np.float32([[point['x'], point['y']] for point in params['roi']])
+    analyzer = SpeedAnalyzer(roi_points, params['distance'], video['fps'])
+    return analyzer, build_speed_pipeline(cap, analyzer, options, name, video)
+
+
+def analyze(mode, params, video_path, name):
+    # One job's analysis: yields ('progress', frames) now and then and
+    # ('result', summary) at the end. Picklable for pool workers.
+    video = video_store.metadata(video_path)
+    options = AnalysisOptions.from_request(params, output=PACKETS)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Error opening video file: {video_path}")
+    analyzer, pipeline = _build(mode, params, cap, video, options, name)
+    reported = 0.0
+    frames = 0
+    for packet in pipeline.run():
+        frames = packet.index
+        if time.monotonic() - reported >= PROGRESS_INTERVAL:
+            reported = time.monotonic()
+            yield 'progress', frames
+    yield 'progress', frames
+    result = analyzer.summary()
+    result['throughput'] = pipeline.stats()
+    yield 'result', result
+
+
+class Job:
+    def __init__(self, job_id, mode, video_path, params):
+        self.id = job_id
+        self.mode = mode
+        self.video_path = video_path
+        self.params = params
+        self.status = QUEUED
+        self.frames = 0
+        self.total_frames = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        # True when the result came from the result cache
+        self.cached = False
+        self.error = None
+
+    def progress(self):
+        elapsed = (self.finished or time.time()) - self.started if self.started else 0.0
+        return {
+            'frames': self.frames,
+            'total_frames': self.total_frames,
+            'percent': round(100.0 * self.frames / self.total_frames, 1) if self.total_frames else None,
+            'fps': round(self.frames / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'video': os.path.basename(self.video_path),
+            'status': self.status,
+            'progress': self.progress(),
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'result': self.result,
+            'cached': self.cached,
+            'error': self.error,
+        }
+
+    def run(self):
+        self.status = RUNNING
+        self.started = time.time()
+        logger.info(f"Job {self.id} started: {self.mode} on {self.video_path}")
+        try:
+            video = video_store.metadata(self.video_path)
+            self.total_frames = video['frame_count']
+            options = AnalysisOptions.from_request(self.params, output=PACKETS)
+            key = result_key(self.mode, self.params, video, options)
+            self.result = result_cache.load_result(key) if key else None
+            if self.result is not None:
+                self.cached = True
+                self.frames = self.total_frames
+                self.status = DONE
+                return
+
+            for kind, value in session_iterator(analyze, self.mode, self.params, self.video_path,
+                                                f"job-{self.id[:8]}"):
+                if kind == 'progress':
+                    self.frames = value
+                else:
+                    self.result = value
+            if key:
+                result_cache.store_result(key, self.result)
+            self.status = DONE
+        except Exception as e:
+            logger.error(f"Job {self.id} failed: {str(e)}")
+            logger.error(f"Error details: {traceback.format_exc()}")
+            self.error = str(e)
+            self.status = FAILED
+        finally:
+            self.finished = time.time()
+            logger.info(f"Job {self.id} {self.status}: {self.progress()}")
+
+
+class JobManager:
+    def __init__(self, workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers or config.JOB_WORKERS, thread_name_prefix="job")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    def submit(self, job_id, mode, video_path, params):
+        validate(mode, params)
+        job = Job(job_id, mode, video_path, params)
+        with self.lock:
+            self.jobs[job_id] = job
+        self.executor.submit(job.run)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+
+job_manager = JobManager()
@@ -1,9 +1,7 @@
-from fastapi import FastAPI, File, UploadFile, Request, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, File, Form, UploadFile, Request, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import FileResponse, StreamingResponse, HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-import shutil
-import cv2
 import os
 import logging
 import traceback
@@ -13,12 +11,22 @@ import base64
 import asyncio
 import io
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from track import process_lines
 from Lane import process_wrong_lane
 from speed import process_speed_detection
-from track_ip import process_ip_stream, update_lines
+from track_ip import process_ip_stream
 from Lane_ip import process_wrong_lane_ip
+from options import AnalysisOptions
+from transport import WEBSOCKET
+from encoder import FrameEncoder
+from jobs import job_manager, validate as validate_job
+from process_pool import worker_pool
+from sessions import session_manager
+from cameras import camera_manager, camera_url
+from video_store import video_store
+import model_registry
+import config
 
 import subprocess
 
@@ -29,11 +37,10 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Global variables
-f_name = None
 stream_task = None
 
 # Ensure the 'uploads' directory exists
-os.makedirs("uploads", exist_ok=True)
+os.makedirs(config.UPLOAD_DIR, exist_ok=True)
 
 STATIC_DIR = "."
 
@@ -44,8 +51,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # The session ID that /update_lines needs comes back in this header
+    expose_headers=["X-Session-ID"],
 )
 
+@app.on_event("startup")
+async def load_models():
+    # Load every configured YOLO weights file once, off the event loop. In
+    # worker-pool mode the workers load their own models and this process
+    # only routes requests.
+    if config.WORKER_PROCESSES > 0:
+        await asyncio.to_thread(worker_pool.start)
+    elif config.PRELOAD_MODELS:
+        await asyncio.to_thread(model_registry.warmup_all)
+
+@app.on_event("shutdown")
+async def stop_workers():
+    if config.WORKER_PROCESSES > 0:
+        await asyncio.to_thread(worker_pool.shutdown)
+
 class Line(BaseModel):
     startX: float
     startY: float
@@ -61,21 +85,47 @@ class IPPort(BaseModel):
     ip: str
     port: str
 
+def stream_options(data):
+    # Per-request options for the HTTP streaming endpoints
+    try:
+        options = AnalysisOptions.from_request(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if options.transport == WEBSOCKET:
+        raise HTTPException(status_code=400, detail="The websocket transport is only available on /ws")
+    return options
+
+def request_session_id(data, request):
+    # Session ID from the JSON body or the query string
+    return data.get('session') or request.query_params.get('session')
+
+def stream_session(session_id):
+    # Session of a live analysis: a new one unless the client names one, so
+    # it never takes over the live settings of the upload session
+    return session_manager.get_or_create(session_id) if session_id else session_manager.create()
+
+def uploaded_session(session_id):
+    # Session whose uploaded video /Count, /Wrong and /Speed analyze
+    session = session_manager.get(session_id)
+    if session is None or session.video_path is None:
+        raise HTTPException(status_code=400, detail="No video file uploaded")
+    return session
+
 @app.get("/")
 def read_index():
     return FileResponse(os.path.join(STATIC_DIR, 'index.html'))
 
 @app.get("/get_snapshot")
-async def get_snapshot(ip: str, port: int):
+async def get_snapshot(ip: str, port: int, quality: Optional[int] = None, max_width: Optional[int] = None):
     try:
-        cap = cv2.VideoCapture(f"http://{ip}:{port}/video")
-        ret, frame = cap.read()
-        if not ret:
+        # Latest frame of the camera's shared reader; the first request for a
+        # camera waits for it to connect
+        frame = await asyncio.to_thread(camera_manager.snapshot, camera_url(ip, port))
+        if frame is None:
             raise HTTPException(status_code=400, detail="Failed to capture snapshot")
-        cap.release()
-        
-        _, buffer = cv2.imencode('.jpg', frame)
-        return StreamingResponse(io.BytesIO(buffer.tobytes()), media_type="image/jpeg")
+
+        jpeg = FrameEncoder(quality, max_width).encode(frame)
+        return StreamingResponse(io.BytesIO(jpeg), media_type="image/jpeg")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -101,7 +151,17 @@ async def count_ip_stream(request: Request):
         if not ip or not port or not lines:
             raise HTTPException(status_code=400, detail="IP, port, and lines are required")
 
-        return StreamingResponse(process_ip_stream(ip, port, lines), media_type="application/x-ndjson")
+        options = stream_options(data)
+        session = stream_session(request_session_id(data, request))
+        settings = session.start_analysis(lines=lines)
+        return StreamingResponse(
+            process_ip_stream(ip, port, lines, options, settings),
+            media_type=options.media_type("application/x-ndjson"),
+            headers={"X-Session-ID": session.id}
+        )
+    except HTTPException:
+        # Bad requests keep their 400
+        raise
     except Exception as e:
         logger.error(f"Error processing IP stream: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -115,10 +175,13 @@ async def process_wrong_lane_ip_endpoint(request: Request):
         if not data.get("ip") or not data.get("port") or not data.get("roi") or not data.get("greenLine") or not data.get("redLine"):
             raise HTTPException(status_code=400, detail="Missing required data")
 
+        options = stream_options(data)
         return StreamingResponse(
-            process_wrong_lane_ip(data),
-            media_type="application/x-ndjson"
+            process_wrong_lane_ip(data, options),
+            media_type=options.media_type("application/x-ndjson")
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing wrong lane IP: {str(e)}")
         logger.error(f"Error details: {traceback.format_exc()}")
@@ -127,36 +190,130 @@ async def process_wrong_lane_ip_endpoint(request: Request):
 
 
 
+async def upload_chunks(file):
+    # Contents of an UploadFile in UPLOAD_CHUNK_SIZE blocks
+    while True:
+        chunk = await file.read(config.UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+async def store_upload(file):
+    # Streams an UploadFile into the video store; (video_path, metadata)
+    upload = video_store.start(file.filename)
+    try:
+        await upload.receive(upload_chunks(file))
+        return await asyncio.to_thread(video_store.complete, upload)
+    except Exception:
+        video_store.discard(upload)
+        raise
+
+def attach_upload(session_id, video_path, metadata):
+    # Requests without a session ID analyze the most recent upload
+    upload_session = session_manager.get_or_create(session_id) if session_id else session_manager.create()
+    upload_session.video_path = video_path
+    session_manager.set_default(upload_session)
+    response = {"info": f"Video '{metadata['filename']}' saved at '{video_path}'", "snapshot": metadata['snapshot'],
+                "session": upload_session.id, "video": metadata,
+                # Where the frontend loads the snapshot and the video from
+                "snapshot_url": f"uploads/{metadata['snapshot']}",
+                "video_url": f"uploads/{os.path.basename(video_path)}"}
+    if config.INDEX_ON_UPLOAD:
+        response["index_job"] = job_manager.submit(job_manager.new_id(), 'index', video_path, {}).id
+    return response
+
 @app.post("/upload_video")
-async def upload_video(file: UploadFile = File(...)):
-    global f_name
+async def upload_video(file: UploadFile = File(...), session: Optional[str] = None):
     try:
-        video_path = os.path.join("uploads", file.filename)
-        
-        with open(video_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        video_path, metadata = await store_upload(file)
         logger.info(f"Video '{file.filename}' uploaded successfully.")
-        
-        f_name = file.filename
-        
-        vidcap = cv2.VideoCapture(video_path)
-        success, image = vidcap.read()
-        if success:
-            snapshot_filename = f"{file.filename}_snapshot.jpg"
-            snapshot_path = os.path.join("uploads", snapshot_filename)
-            cv2.imwrite(snapshot_path, image)
-            logger.info(f"Snapshot for video '{file.filename}' saved successfully.")
-            return {"info": f"Video '{file.filename}' saved at '{video_path}' and snapshot saved at '{snapshot_path}'", "snapshot": snapshot_filename}
-        else:
-            logger.error(f"Failed to read the video file '{file.filename}'.")
-            raise HTTPException(status_code=400, detail="Failed to read video file")
+        return attach_upload(session, video_path, metadata)
+    except ValueError as e:
+        logger.error(f"Failed to read the video file '{file.filename}': {e}")
+        raise HTTPException(status_code=400, detail="Failed to read video file")
     except Exception as e:
         logger.error(f"Error uploading video '{file.filename}': {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+# Resumable uploads: POST /upload_sessions {"filename"} starts one, PUT
+# /upload_sessions/{id}?offset=N appends the raw request body at offset N, GET
+# /upload_sessions/{id} reports the offset to resume from, and POST
+# /upload_sessions/{id}/complete stores the video like /upload_video does.
+# GET /uploads/{name} serves the stored videos and snapshots.
+
+@app.get("/uploads/{name}")
+def get_uploaded_file(name: str):
+    file_location = os.path.join(config.UPLOAD_DIR, os.path.basename(name))
+    if os.path.isfile(file_location):
+        return FileResponse(file_location)
+    raise HTTPException(status_code=404, detail="File not found")
+
+@app.post("/upload_sessions")
+async def start_upload(request: Request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    upload = await asyncio.to_thread(video_store.start, data.get('filename'))
+    return upload.info()
+
+@app.get("/upload_sessions/{upload_id}")
+async def get_upload(upload_id: str):
+    try:
+        return video_store.get(upload_id).info()
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+@app.put("/upload_sessions/{upload_id}")
+async def append_upload(upload_id: str, request: Request, offset: Optional[int] = None):
+    try:
+        upload = video_store.claim(upload_id, offset)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        await upload.receive(request.stream())
+        return upload.info()
+    except Exception as e:
+        # Whatever arrived before the connection broke is kept
+        logger.error(f"Error receiving upload {upload_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        video_store.release(upload)
+
+@app.post("/upload_sessions/{upload_id}/complete")
+async def complete_upload(upload_id: str, session: Optional[str] = None):
+    try:
+        upload = video_store.claim(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        video_path, metadata = await asyncio.to_thread(video_store.complete, upload)
+        return attach_upload(session, video_path, metadata)
+    except ValueError as e:
+        video_store.discard(upload)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error completing upload {upload_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        video_store.release(upload)
+
+@app.delete("/upload_sessions/{upload_id}")
+async def delete_upload(upload_id: str):
+    try:
+        video_store.discard(video_store.claim(upload_id))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"deleted": upload_id}
+
 @app.post("/Count")
 async def process_multiple_lines(request: Request):
-    global f_name
     try:
         data = await request.json()
         lines = data.get('lines', [])
@@ -164,14 +321,20 @@ async def process_multiple_lines(request: Request):
         if not lines:
             raise HTTPException(status_code=400, detail="No lines provided")
 
-        if f_name is None:
-            raise HTTPException(status_code=400, detail="No video file uploaded")
-
-        video_path = os.path.join("uploads", f_name)
+        session = uploaded_session(request_session_id(data, request))
+        video_path = session.video_path
         logger.info(f"Processing video: {video_path}")
         logger.info(f"Lines: {lines}")
 
-        return StreamingResponse(process_lines(lines, video_path), media_type="text/event-stream")
+        options = stream_options(data)
+        settings = session.start_analysis(lines=lines)
+        return StreamingResponse(
+            process_lines(lines, video_path, options, settings),
+            media_type=options.media_type("text/event-stream"),
+            headers={"X-Session-ID": session.id}
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing lines: {str(e)}")
         logger.error(f"Error details: {traceback.format_exc()}")
@@ -179,7 +342,6 @@ async def process_multiple_lines(request: Request):
 
 @app.post("/Wrong")
 async def process_wrong_lane_endpoint(request: Request):
-    global f_name
     try:
         data = await request.json()
         roi_points = data.get('roi', [])
@@ -189,16 +351,19 @@ async def process_wrong_lane_endpoint(request: Request):
         if not roi_points or not green_line or not red_line:
             raise HTTPException(status_code=400, detail="Missing required data")
 
-        if f_name is None:
-            raise HTTPException(status_code=400, detail="No video file uploaded")
-
-        video_path = os.path.join("uploads", f_name)
+        video_path = uploaded_session(request_session_id(data, request)).video_path
         logger.info(f"Processing video: {video_path}")
         logger.info(f"ROI: {roi_points}")
         logger.info(f"Green Line: {green_line}")
         logger.info(f"Red Line: {red_line}")
 
-        return StreamingResponse(process_wrong_lane(roi_points, green_line, red_line, video_path), media_type="text/event-stream")
+        options = stream_options(data)
+        return StreamingResponse(
+            process_wrong_lane(roi_points, green_line, red_line, video_path, options),
+            media_type=options.media_type("text/event-stream")
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing Wrong Lane: {str(e)}")
         logger.error(f"Error details: {traceback.format_exc()}")
@@ -206,7 +371,6 @@ async def process_wrong_lane_endpoint(request: Request):
 
 @app.post("/Speed")
 async def process_speed(request: Request):
-    global f_name
     try:
         data = await request.json()
         roi_points = data.get('roi', [])
@@ -215,23 +379,92 @@ async def process_speed(request: Request):
         if not roi_points or not distance_meters:
             raise HTTPException(status_code=400, detail="Missing required data")
 
-        if f_name is None:
-            raise HTTPException(status_code=400, detail="No video file uploaded")
-
-        video_path = os.path.join("uploads", f_name)
+        video_path = uploaded_session(request_session_id(data, request)).video_path
         logger.info(f"Processing video for speed detection: {video_path}")
         logger.info(f"ROI: {roi_points}")
         logger.info(f"Distance: {distance_meters} meters")
 
         roi_points_np = np.float32([[point['x'], point['y']] for point in roi_points])
 
-        return StreamingResponse(process_speed_detection(video_path, roi_points_np, distance_meters), media_type="text/event-stream")
+        options = stream_options(data)
+        return StreamingResponse(
+            process_speed_detection(video_path, roi_points_np, distance_meters, options),
+            media_type=options.media_type("text/event-stream")
+        )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing speed detection: {str(e)}")
         logger.error(f"Error details: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/models/warmup")
+async def warmup_models(request: Request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    try:
+        weights = data.get('models') or config.configured_models()
+        if config.WORKER_PROCESSES > 0:
+            # Models live in the workers; busy ones load theirs on first use
+            loaded = await asyncio.to_thread(worker_pool.broadcast, model_registry.warmup_and_list, weights)
+            return {"loaded": sorted({name for models in loaded for name in models}), "workers": len(loaded)}
+        await asyncio.to_thread(model_registry.warmup_all, weights)
+        return {"loaded": model_registry.loaded_models()}
+    except Exception as e:
+        logger.error(f"Error warming up models: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/jobs")
+async def create_job(file: UploadFile = File(...), job_config: str = Form(..., alias="config")):
+    # Offline analysis: 'config' is the JSON body /Count, /Wrong or /Speed
+    # would take, plus 'mode' (count, wrong or speed)
+    try:
+        params = json.loads(job_config)
+        validate_job(params.get('mode'), params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        video_path, _ = await store_upload(file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        job_id = job_manager.new_id()
+        job = job_manager.submit(job_id, params['mode'], video_path, params)
+        logger.info(f"Job {job_id} queued for '{file.filename}'")
+        return job.as_dict()
+    except Exception as e:
+        logger.error(f"Error creating job: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/index")
+async def index_video(request: Request):
+    # Preprocess the session's uploaded video into detection indexes (an
+    # 'index' job); tuning options such as batch_size are taken from the body
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    session = uploaded_session(request_session_id(data, request))
+    try:
+        job = job_manager.submit(job_manager.new_id(), 'index', session.video_path, data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.as_dict()
+
+@app.get("/jobs")
+async def list_jobs():
+    return [job.as_dict() for job in job_manager.list()]
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.as_dict()
+
 @app.post("/Segmentation")
 async def process_segmentation(request: Request):
     return await process_generic(request, "Segmentation")
@@ -241,7 +474,6 @@ async def process_all(request: Request):
     return await process_generic(request, "All")
 
 async def process_generic(request: Request, mode: str):
-    global f_name
     try:
         data = await request.json()
         lines = data.get('lines', [])
@@ -249,10 +481,7 @@ async def process_generic(request: Request, mode: str):
         if not lines:
             raise HTTPException(status_code=400, detail="No lines provided")
 
-        if f_name is None:
-            raise HTTPException(status_code=400, detail="No video file uploaded")
-
-        video_path = os.path.join("uploads", f_name)
+        video_path = uploaded_session(request_session_id(data, request)).video_path
         logger.info(f"Processing video: {video_path}")
         logger.info(f"Lines: {lines}")
         logger.info(f"Mode: {mode}")
@@ -271,14 +500,64 @@ def get_static_file(file_path: str):
     else:
         raise HTTPException(status_code=404, detail="File not found")
 
+def open_analysis(data, options):
+    # Analysis generator for a /ws request; 'mode' selects the feature
+    mode = data.get('mode')
+    session = session_manager.get(data.get('session'))
+    if mode in ('count', 'wrong', 'speed') and (session is None or session.video_path is None):
+        raise ValueError("No video file uploaded")
+
+    if mode == 'count':
+        if not data.get('lines'):
+            raise ValueError("No lines provided")
+        settings = session.start_analysis(lines=data['lines'])
+        return process_lines(data['lines'], session.video_path, options, settings)
+    if mode == 'wrong':
+        if not data.get('roi') or not data.get('greenLine') or not data.get('redLine'):
+            raise ValueError("Missing required data")
+        return process_wrong_lane(data['roi'], data['greenLine'], data['redLine'], session.video_path, options)
+    if mode == 'speed':
+        if not data.get('roi') or not data.get('distance'):
+            raise ValueError("Missing required data")
+        roi_points_np = np.float32([[point['x'], point['y']] for point in data['roi']])
+        return process_speed_detection(session.video_path, roi_points_np, data['distance'], options)
+    if mode == 'count_ip':
+        if not data.get('ip') or not data.get('port') or not data.get('lines'):
+            raise ValueError("IP, port, and lines are required")
+        settings = stream_session(data.get('session')).start_analysis(lines=data['lines'])
+        return process_ip_stream(data['ip'], data['port'], data['lines'], options, settings)
+    if mode == 'wrong_ip':
+        if not data.get("ip") or not data.get("port") or not data.get("roi") or not data.get("greenLine") or not data.get("redLine"):
+            raise ValueError("Missing required data")
+        return process_wrong_lane_ip(data, options)
+    raise ValueError(f"Unknown mode: {mode}")
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    # Messages with a 'mode' start an analysis that streams binary frames:
+    # each frame is a JSON text message with the metadata followed by a
+    # binary message with the JPEG. Other messages are echoed back.
     await websocket.accept()
     try:
         while True:
             data = await websocket.receive_text()
             parsed_data = json.loads(data)
-            await websocket.send_text(f"Received: {json.dumps(parsed_data)}")
+            if 'mode' not in parsed_data:
+                await websocket.send_text(f"Received: {json.dumps(parsed_data)}")
+                continue
+
+            try:
+                options = AnalysisOptions.from_request({**parsed_data, 'transport': WEBSOCKET})
+                stream = open_analysis(parsed_data, options)
+            except ValueError as e:
+                await websocket.send_text(json.dumps({"error": str(e)}))
+                continue
+
+            async for metadata, jpeg in stream:
+                await websocket.send_text(metadata)
+                if jpeg is not None:
+                    await websocket.send_bytes(jpeg)
+            await websocket.send_text(json.dumps({"done": True}))
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected")
     except Exception as e:
@@ -290,8 +569,10 @@ async def process_stream(request: StreamRequest):
     try:
         async def generate():
             try:
-                async for frame_data in process_ip_stream(request.ip, request.port, request.lines):
-                    yield (json.dumps(frame_data) + "\n").encode('utf-8')
+                lines = [line.dict() for line in request.lines]
+                settings = session_manager.get_or_create().start_analysis(lines=lines)
+                async for frame_data in process_ip_stream(request.ip, request.port, lines, settings=settings):
+                    yield frame_data
             except Exception as e:
                 yield json.dumps({"error": str(e)}).encode('utf-8')
 
@@ -329,8 +610,14 @@ async def update_lines_endpoint(request: Request):
         if not lines:
             raise HTTPException(status_code=400, detail="No lines provided")
         
-        update_lines(lines)
-        return {"message": "Lines updated successfully"}
+        # Reaches the session's running count analysis on its next frame
+        session = session_manager.get(request_session_id(data, request))
+        if session is None or session.settings is None:
+            raise HTTPException(status_code=404, detail="No count analysis running for this session")
+        session.settings.update(lines=lines)
+        return {"message": "Lines updated successfully", "session": session.id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating lines: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,75 @@
+import threading
+import logging
+import numpy as np
+from ultralytics import YOLO
+import config
+
+logger = logging.getLogger(__name__)
+
+# One YOLO instance per weights file, shared by every request in the process
+_models = {}
+# Guards creation of the per-weights locks below
+_registry_lock = threading.Lock()
+# Per-weights locks: serialise loading and inference on a shared model
+_model_locks = {}
+
+
+def _lock_for(weights):
+    with _registry_lock:
+        lock = _model_locks.get(weights)
+        if lock is None:
+            lock = threading.RLock()
+            _model_locks[weights] = lock
+        return lock
+
+
+def get_model(weights=None):
+    weights = weights or config.DEFAULT_MODEL
+    model = _models.get(weights)
+    if model is not None:
+        return model
+
+    with _lock_for(weights):
+        # Another caller may have finished loading while we waited
+        model = _models.get(weights)
+        if model is None:
+            logger.info(f"Loading YOLO weights: {weights}")
+            model = YOLO(weights)
+            _models[weights] = model
+        return model
+
+
+def predict(source, weights=None, **kwargs):
+    # YOLO models are not safe to call from several threads at once,
+    # so inference on a shared instance is serialised per weights file.
+    weights = weights or config.DEFAULT_MODEL
+    model = get_model(weights)
+    kwargs.setdefault("verbose", False)
+    with _lock_for(weights):
+        return model.predict(source, **kwargs)
+
+
+def warmup(weights=None):
+    weights = weights or config.DEFAULT_MODEL
+    size = config.WARMUP_IMAGE_SIZE
+    dummy = np.zeros((size, size, 3), dtype=np.uint8)
+    predict(dummy, weights)
+    logger.info(f"Warmed up YOLO weights: {weights}")
+
+
+def warmup_all(weights_list=None):
+    for weights in weights_list or config.configured_models():
+        try:
+            warmup(weights)
+        except Exception as e:
+            logger.error(f"Failed to warm up {weights}: {str(e)}")
+
+
+def loaded_models():
+    return list(_models.keys())
+
+
+def warmup_and_list(weights_list=None):
+    # warmup_all() for pool workers: returns the models loaded in the worker
+    warmup_all(weights_list)
+    return loaded_models()
@@ -0,0 +1,153 @@
+import cv2
+from inference import BatchDetector
+from result_cache import DetectionCache, result_cache, cache_key
+from pipeline import Stage, Pacer, capture_source
+from cameras import CameraSource, LiveStats, camera_url
+from detection_index import index_source
+from encoder import FrameEncoder
+from transport import TRANSPORTS, JSON, WEBSOCKET, formatter, format_error, format_metadata, media_type
+import config
+
+# What the analysis endpoints stream: annotated frames, or per-frame metadata
+# only (boxes, IDs, crossings, speeds) as NDJSON without drawing or encoding
+FRAMES = 'frames'
+METADATA = 'metadata'
+OUTPUTS = (FRAMES, METADATA)
+# Internal: no output stages at all, the caller consumes the packets itself
+# (offline jobs). Not selectable from a request.
+PACKETS = 'packets'
+
+# Per-request tuning knobs shared by the analysis endpoints. Every field is
+# optional in the request body; missing ones fall back to config defaults.
+
+
+class AnalysisOptions:
+    def __init__(self, batch_size=None, batch_max_wait=None, detect_stride=1, crop_roi=None, crop_padding=None,
+                 transport=JSON, output=FRAMES, preview_fps=None, max_width=None,
+                 jpeg_quality=None, live_latest=None, debug_view=False):
+        self.batch_size = None if batch_size is None else int(batch_size)
+        self.batch_max_wait = None if batch_max_wait is None else float(batch_max_wait)
+        if self.batch_size is not None and self.batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if self.batch_max_wait is not None and self.batch_max_wait < 0:
+            raise ValueError("batch_max_wait must not be negative")
+        self.detect_stride = max(1, int(detect_stride or 1))
+        self.crop_roi = config.CROP_TO_ROI if crop_roi is None else bool(crop_roi)
+        self.crop_padding = config.CROP_PADDING if crop_padding is None else int(crop_padding)
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport '{transport}', expected one of {', '.join(TRANSPORTS)}")
+        self.transport = transport
+        if output not in OUTPUTS and output != PACKETS:
+            raise ValueError(f"Unknown output '{output}', expected one of {', '.join(OUTPUTS)}")
+        self.output = output
+        # Preview rate and size; analysis still covers every frame
+        self.preview_fps = config.PREVIEW_FPS if preview_fps is None else float(preview_fps)
+        self.max_width = config.PREVIEW_MAX_WIDTH if max_width is None else int(max_width)
+        if self.preview_fps < 0 or self.max_width < 0:
+            raise ValueError("preview_fps and max_width must not be negative")
+        self.jpeg_quality = config.JPEG_QUALITY if jpeg_quality is None else int(jpeg_quality)
+        if not 1 <= self.jpeg_quality <= 100:
+            raise ValueError("jpeg_quality must be between 1 and 100")
+        # Live streams: analyze the newest camera frame only
+        self.live_latest = config.LIVE_LATEST_FRAME if live_latest is None else bool(live_latest)
+        # Analysis-specific debug drawing (speed: warped bird's-eye inset)
+        self.debug_view = bool(debug_view)
+
+    @classmethod
+    def from_request(cls, data, **overrides):
+        output = data.get('output') or FRAMES
+        if output not in OUTPUTS:
+            raise ValueError(f"Unknown output '{output}', expected one of {', '.join(OUTPUTS)}")
+        kwargs = dict(
+            batch_size=data.get('batch_size'),
+            batch_max_wait=data.get('batch_max_wait'),
+            detect_stride=data.get('detect_stride', 1),
+            crop_roi=data.get('crop_roi'),
+            crop_padding=data.get('crop_padding'),
+            transport=data.get('transport') or JSON,
+            output=output,
+            preview_fps=data.get('preview_fps'),
+            max_width=data.get('max_width'),
+            jpeg_quality=data.get('jpeg_quality'),
+            live_latest=data.get('live_latest'),
+            debug_view=data.get('debug_view'),
+        )
+        kwargs.update(overrides)
+        return cls(**kwargs)
+
+    def format_stage(self):
+        return Stage('format', formatter(self.transport))
+
+    def output_stages(self, annotate, describe, live=False):
+        # Stages after tracking: draw + encode + format, or metadata only.
+        # With a preview rate, frames reach the drawing stages through a
+        # latest-only slot paced to preview_fps: frames the client cannot
+        # take in time are dropped there instead of queueing, while the
+        # stages before it keep analyzing every frame at full speed.
+        # live=True adds the drop/latency stats of live streams right before
+        # formatting, so they cover everything up to the frame being sent.
+        if self.output == PACKETS:
+            return []
+        stats = [Stage('live', LiveStats())] if live else []
+        if self.output == METADATA:
+            return [*stats, Stage('format', lambda packet: format_metadata(self.transport, packet, describe(packet)))]
+        stages = []
+        if self.preview_fps:
+            stages.append(Stage('preview', Pacer(self.preview_fps), latest=True))
+        stages += [
+            Stage('annotate', annotate),
+            Stage('encode', FrameEncoder(self.jpeg_quality, self.max_width).encode_packet),
+            *stats,
+            self.format_stage(),
+        ]
+        return stages
+
+    def media_type(self, default):
+        if self.output == METADATA:
+            return "application/x-ndjson"
+        return media_type(self.transport, default)
+
+    def format_error(self, message):
+        if self.output == METADATA and self.transport != WEBSOCKET:
+            return format_error(JSON, message)
+        return format_error(self.transport, message)
+
+    def batch_detector(self, weights, roi=None, batch_size=None, max_wait=None, video=None):
+        # roi is only used when ROI cropping is enabled; batch_size/max_wait
+        # override the request values (live streams detect one frame at a time).
+        # video: upload metadata (video_store); its detections are cached.
+        detector = BatchDetector(
+            weights,
+            batch_size if batch_size is not None else self.batch_size,
+            max_wait if max_wait is not None else self.batch_max_wait,
+            self.detect_stride,
+            roi=roi if self.crop_roi else None,
+            crop_padding=self.crop_padding,
+        )
+        if video is not None and video.get('hash') and result_cache.enabled:
+            settings = detector.settings()
+            # The full-frame index of every frame serves any stride and crop
+            full_frame = dict(settings, detect_stride=1, crop=None)
+            fallback = cache_key('detections', video['hash'], full_frame) if full_frame != settings else None
+            detector.cache = DetectionCache(cache_key('detections', video['hash'], settings), fallback_key=fallback)
+        return detector
+
+    def detection_source(self, cap, batch_detector):
+        # (source, detect stages) for a video file. When nothing is drawn and
+        # the video's detections are cached, packets come from the detection
+        # index: the video is neither decoded nor run through the model. The
+        # replay stage still applies detect_stride and reports throughput.
+        cache = batch_detector.cache
+        if self.output != FRAMES and cache is not None and cache.hit:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            cap.release()
+            return index_source(cache.index, fps), [batch_detector.replay_stage()]
+        return capture_source(cap), [batch_detector.stage()]
+
+    def live_source(self, ip, port, weights, roi=None):
+        # (source, detect stages) for a live camera. Frames come from the
+        # camera's shared reader, which reconnects on its own, and are
+        # detected one at a time to keep latency low.
+        detector = self.batch_detector(weights, roi=roi, batch_size=1, max_wait=0)
+        source = CameraSource(camera_url(ip, port), latest=self.live_latest)
+        return source, [detector.stage(latest=self.live_latest)]
@@ -0,0 +1,366 @@
+import queue
+import threading
+import time
+import logging
+import contextlib
+import cv2
+import config
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+# Cancel event of the session the current thread is running, see cancel_on()
+_session = threading.local()
+
+# Payload entries that hold changes since the previous packet rather than the
+# full state (speed deltas): dicts are merged by key, lists concatenated
+DELTA_KEYS = ('vehicle_data', 'vehicles_removed')
+
+
+class FramePacket:
+    # Everything a frame accumulates on its way through the stages
+    __slots__ = ('index', 'frame', 'detections', 'result', 'payload', 'jpeg', 'captured', 'timestamp')
+
+    def __init__(self, index, frame, captured=None, timestamp=None):
+        self.index = index
+        self.frame = frame
+        # time.monotonic() when a live frame was read from the camera
+        self.captured = captured
+        # Presentation time in seconds since the start of the video or
+        # stream: the container timestamp of a file frame, the capture time
+        # of a live one. Unlike index / fps it stays right for variable frame
+        # rates and dropped or skipped frames.
+        self.timestamp = timestamp
+        self.detections = None
+        self.result = None
+        # Metadata sent alongside the frame; stages add their own keys
+        self.payload = {}
+        self.jpeg = None
+
+    def carry_over(self, dropped):
+        # Takes on the delta entries of an older packet that is dropped in
+        # its favour, so clients applying deltas do not miss any
+        for key in DELTA_KEYS:
+            if key not in dropped.payload:
+                continue
+            older = dropped.payload[key]
+            newer = self.payload.get(key)
+            if newer is None:
+                self.payload[key] = older
+            elif isinstance(older, dict):
+                self.payload[key] = {**older, **newer}
+            else:
+                self.payload[key] = older + newer
+
+
+class _Failure:
+    def __init__(self, stage, exc):
+        self.stage = stage
+        self.exc = exc
+
+
+def _is_marker(item):
+    return item is _END or isinstance(item, _Failure)
+
+
+class LatestQueue(queue.Queue):
+    # Single-slot queue where a new item replaces the one still waiting, so a
+    # slow consumer always gets the freshest item and the producer never
+    # blocks. End/failure markers are never replaced; a replaced packet hands
+    # its deltas on to the new one.
+    def __init__(self, on_drop=None):
+        super().__init__(1)
+        self.on_drop = on_drop
+
+    def put(self, item, block=True, timeout=None):
+        if not _is_marker(item):
+            with self.mutex:
+                if self._qsize() and not _is_marker(self.queue[-1]):
+                    if isinstance(item, FramePacket):
+                        item.carry_over(self.queue[-1])
+                    self.queue[-1] = item
+                    if self.on_drop is not None:
+                        self.on_drop()
+                    return
+        super().put(item, block, timeout)
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.dropped = 0
+        self.started = None
+
+    def record(self, count, seconds):
+        if self.started is None:
+            self.started = time.monotonic() - seconds
+        self.items += count
+        self.busy += seconds
+
+    def drop(self):
+        self.dropped += 1
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started if self.started is not None else 0.0
+        stats = {
+            'items': self.items,
+            # Items per second of wall time since the stage produced its first item
+            'fps': round(self.items / elapsed, 2) if elapsed > 0 else 0.0,
+            # Items per second of time spent inside the stage: its own ceiling
+            'capacity_fps': round(self.items / self.busy, 2) if self.busy > 0 else 0.0,
+            'busy_seconds': round(self.busy, 3),
+        }
+        if self.dropped:
+            # Items replaced in a latest-only input before the stage took them
+            stats['dropped'] = self.dropped
+        return stats
+
+
+class Stage:
+    # Applies fn to every item; fn may return None to drop the item. With
+    # latest=True the stage reads from a LatestQueue: items that arrive while
+    # it is busy replace each other, and the queues after it hold one item.
+    # on_end is called once the source is exhausted and every item went
+    # through the stage (not when the pipeline is stopped or failed).
+    def __init__(self, name, fn, latest=False, on_end=None):
+        self.name = name
+        self.fn = fn
+        self.latest = latest
+        self.on_end = on_end
+        self.batch_size = 1
+        self.max_wait = 0.0
+
+    def process(self, items):
+        result = self.fn(items[0])
+        return [] if result is None else [result]
+
+
+class BatchStage(Stage):
+    # Collects up to batch_size items (waiting at most max_wait seconds after the
+    # first one) and passes them to fn as a list; fn returns a list in order
+    def __init__(self, name, fn, batch_size, max_wait, latest=False, on_end=None):
+        super().__init__(name, fn, latest, on_end)
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = float(max_wait)
+
+    def process(self, items):
+        return [item for item in self.fn(items) if item is not None]
+
+
+class Pipeline:
+    def __init__(self, source, stages, maxsize=None, name="pipeline"):
+        # source: iterable producing items (the decode stage)
+        self.source = source
+        self.stages = stages
+        self.name = name
+        self.maxsize = maxsize or config.PIPELINE_QUEUE_SIZE
+        self.stop_event = threading.Event()
+        self.stats_by_stage = {'decode': StageStats('decode')}
+        for stage in stages:
+            self.stats_by_stage[stage.name] = StageStats(stage.name)
+        self.threads = []
+        self._last_log = time.monotonic()
+
+    def stats(self):
+        return {name: s.as_dict() for name, s in self.stats_by_stage.items()}
+
+    def stop(self):
+        self.stop_event.set()
+        # Sources that block waiting for input (live cameras) can be woken up
+        stop_source = getattr(self.source, 'stop', None)
+        if stop_source is not None:
+            stop_source()
+
+    def _put(self, q, item):
+        # Blocking put that gives up once the pipeline is stopped
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q, timeout=0.2):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=timeout)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _run_source(self, out_q):
+        stats = self.stats_by_stage['decode']
+        iterator = iter(self.source)
+        try:
+            while not self.stop_event.is_set():
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stats.record(1, time.perf_counter() - started)
+                if not self._put(out_q, item):
+                    break
+        except Exception as e:
+            self._put(out_q, _Failure('decode', e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+            self._put(out_q, _END)
+
+    def _collect(self, stage, in_q, first):
+        # Returns the batch plus an end/failure marker seen while filling it
+        items = [first]
+        deadline = time.monotonic() + stage.max_wait
+        while len(items) < stage.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = in_q.get(timeout=remaining) if remaining > 0 else in_q.get_nowait()
+            except queue.Empty:
+                break
+            if _is_marker(item):
+                return items, item
+            items.append(item)
+        return items, None
+
+    def _end_stage(self, stage, marker, out_q):
+        if marker is _END and stage.on_end is not None and not self.stop_event.is_set():
+            stage.on_end()
+        self._put(out_q, marker)
+
+    def _run_stage(self, stage, in_q, out_q):
+        stats = self.stats_by_stage[stage.name]
+        try:
+            while True:
+                item = self._get(in_q)
+                if _is_marker(item):
+                    self._end_stage(stage, item, out_q)
+                    return
+                marker = None
+                items = [item]
+                if stage.batch_size > 1:
+                    items, marker = self._collect(stage, in_q, item)
+                started = time.perf_counter()
+                results = stage.process(items)
+                stats.record(len(items), time.perf_counter() - started)
+                for result in results:
+                    if not self._put(out_q, result):
+                        return
+                if marker is not None:
+                    self._end_stage(stage, marker, out_q)
+                    return
+        except Exception as e:
+            self._put(out_q, _Failure(stage.name, e))
+
+    def _maybe_log_stats(self):
+        interval = config.PIPELINE_STATS_INTERVAL
+        if interval and time.monotonic() - self._last_log >= interval:
+            self._last_log = time.monotonic()
+            logger.info(f"{self.name} stage throughput: {self.stats()}")
+
+    def _watch_cancel(self, cancel):
+        # Stops the pipeline as soon as its session is cancelled, even while
+        # nothing comes out of it (a live camera that is down)
+        while not self.stop_event.is_set():
+            if cancel.wait(0.2):
+                self.stop()
+                return
+
+    def run(self):
+        # Start one thread per stage and yield the final stage's output in order
+        queues = []
+        after_latest = False
+        for stage in self.stages:
+            if stage.latest:
+                queues.append(LatestQueue(on_drop=self.stats_by_stage[stage.name].drop))
+                after_latest = True
+            else:
+                queues.append(queue.Queue(1 if after_latest else self.maxsize))
+        queues.append(queue.Queue(1 if after_latest else self.maxsize))
+        self.threads = [threading.Thread(target=self._run_source, args=(queues[0],),
+                                         name=f"{self.name}-decode", daemon=True)]
+        for i, stage in enumerate(self.stages):
+            self.threads.append(threading.Thread(target=self._run_stage, args=(stage, queues[i], queues[i + 1]),
+                                                 name=f"{self.name}-{stage.name}", daemon=True))
+        for thread in self.threads:
+            thread.start()
+        cancel = current_cancel()
+        if cancel is not None:
+            threading.Thread(target=self._watch_cancel, args=(cancel,), name=f"{self.name}-cancel",
+                             daemon=True).start()
+
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    logger.error(f"{self.name} failed in stage '{item.stage}': {str(item.exc)}")
+                    raise item.exc
+                self._maybe_log_stats()
+                yield item
+        finally:
+            self.stop()
+            logger.info(f"{self.name} stage throughput: {self.stats()}")
+
+
+@contextlib.contextmanager
+def cancel_on(event):
+    # Pipelines run by this thread inside the block stop once `event` (a
+    # threading or multiprocessing Event) is set
+    previous = getattr(_session, 'cancel', None)
+    _session.cancel = event
+    try:
+        yield
+    finally:
+        _session.cancel = previous
+
+
+def current_cancel():
+    return getattr(_session, 'cancel', None)
+
+
+def capture_source(cap):
+    # Decode stage: wrap each frame read from the capture in a FramePacket
+    # stamped with its container timestamp. Backends that report no usable
+    # position get the previous timestamp plus one nominal frame interval.
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    interval = 1.0 / fps if fps and fps > 0 else 0.0
+    index = 0
+    timestamp = None
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            index += 1
+            position = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            if timestamp is None:
+                timestamp = max(position, 0.0)
+            elif position > timestamp:
+                timestamp = position
+            else:
+                timestamp += interval
+            yield FramePacket(index, frame, timestamp=timestamp)
+    finally:
+        cap.release()
+
+
+class Pacer:
+    # Stage fn that passes at most fps items per second by waiting between
+    # them. Behind a latest-only input the wait is what drops stale items.
+    def __init__(self, fps):
+        self.interval = 1.0 / fps
+        self.next_at = 0.0
+
+    def __call__(self, item):
+        wait = self.next_at - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.next_at = time.monotonic() + self.interval
+        return item
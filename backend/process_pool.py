@@ -0,0 +1,233 @@
+import os
+import queue
+import threading
+import logging
+import itertools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from sessions import RemoteSettings
+from pipeline import cancel_on, current_cancel
+import config
+
+logger = logging.getLogger(__name__)
+
+# Worker-pool mode: every analysis session runs in one of a fixed set of
+# worker processes, so the Python-side work of concurrent sessions (decode,
+# tracking, drawing, encoding) is spread over several cores. Each worker runs
+# one session at a time and keeps its models loaded between sessions. The
+# HTTP process only hands out tasks and relays the results, which come back
+# through a bounded per-worker queue.
+
+# Messages on a worker's result queue
+_ITEM = 'item'
+_ERROR = 'error'
+_END = 'end'
+
+
+def _cpu_sets(size):
+    # Split the CPUs this process may use into `size` disjoint sets
+    cpus = sorted(os.sched_getaffinity(0))
+    per_worker = max(1, len(cpus) // size)
+    return [cpus[(i * per_worker) % len(cpus):][:per_worker] for i in range(size)]
+
+
+def _worker_main(index, cpus, tasks, results, cancel, updates):
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+        import cv2
+        cv2.setNumThreads(len(cpus))
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"Worker {index} started (pid {os.getpid()}, cpus {cpus or 'any'})")
+
+    if config.PRELOAD_MODELS:
+        import model_registry
+        model_registry.warmup_all()
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, fn, args, settings = task
+        iterator = None
+        # Pipelines of the session stop once it is cancelled, also while they
+        # wait for input (a live camera that is down)
+        with cancel_on(cancel):
+            try:
+                if settings is None:
+                    iterator = iter(fn(*args))
+                else:
+                    # Live updates for this session arrive on the updates queue
+                    iterator = iter(fn(*args, settings=RemoteSettings(settings, updates, task_id)))
+                for item in iterator:
+                    if cancel.is_set():
+                        break
+                    results.put((_ITEM, item))
+            except Exception as e:
+                logger.error(f"Worker {index} session failed: {str(e)}")
+                results.put((_ERROR, str(e)))
+            finally:
+                close = getattr(iterator, 'close', None)
+                if close is not None:
+                    close()
+                results.put((_END, None))
+
+
+def _call(fn, *args):
+    # Task wrapper for plain functions: a session with fn's result as its only item
+    yield fn(*args)
+
+
+class _Worker:
+    def __init__(self, ctx, index, cpus):
+        self.index = index
+        self.cpus = cpus
+        self.ctx = ctx
+        self.start()
+
+    def start(self):
+        self.tasks = self.ctx.Queue()
+        self.results = self.ctx.Queue(config.STREAM_QUEUE_SIZE)
+        self.cancel = self.ctx.Event()
+        self.updates = self.ctx.Queue()
+        self.process = self.ctx.Process(target=_worker_main, name=f"analysis-worker-{self.index}",
+                                        args=(self.index, self.cpus, self.tasks, self.results, self.cancel,
+                                              self.updates),
+                                        daemon=True)
+        self.process.start()
+
+    def get(self, cancel=None):
+        # Next result message, or None once `cancel` is set while waiting;
+        # fails instead of hanging if the process died
+        while True:
+            try:
+                return self.results.get(timeout=0.5)
+            except queue.Empty:
+                if cancel is not None and cancel.is_set():
+                    return None
+                if not self.process.is_alive():
+                    raise RuntimeError(f"Analysis worker {self.index} exited with code {self.process.exitcode}")
+
+
+class WorkerPool:
+    def __init__(self, size=None, pin_cpus=None):
+        self.size = size or config.WORKER_PROCESSES
+        self.pin_cpus = config.WORKER_PIN_CPUS if pin_cpus is None else pin_cpus
+        self.workers = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.task_ids = itertools.count()
+
+    def start(self):
+        with self.lock:
+            if self.workers:
+                return
+            # spawn: CUDA and the inference threads do not survive a fork
+            ctx = multiprocessing.get_context('spawn')
+            if self.pin_cpus and not hasattr(os, 'sched_setaffinity'):
+                logger.warning("CPU pinning is not supported on this platform")
+                self.pin_cpus = False
+            cpu_sets = _cpu_sets(self.size) if self.pin_cpus else [None] * self.size
+            for index, cpus in enumerate(cpu_sets):
+                worker = _Worker(ctx, index, cpus)
+                self.workers.append(worker)
+                self.idle.put(worker)
+            logger.info(f"Started {self.size} analysis worker processes")
+
+    def run(self, fn, *args, settings=None):
+        # Blocking iterator over fn(*args) executed in a free worker; waits for
+        # one when all are busy. fn and args must be picklable. Updates of a
+        # sessions.LiveSettings are forwarded to the worker while it runs.
+        # The session is cancelled when the caller's cancel_on() event is set.
+        self.start()
+        yield from self._run_on(self.idle.get(), fn, args, settings)
+
+    def call(self, fn, *args):
+        # fn(*args) in a free worker, returning its result
+        return list(self.run(_call, fn, *args))[0]
+
+    def broadcast(self, fn, *args):
+        # fn(*args) in every worker that is idle right now, concurrently;
+        # busy workers are skipped. Returns the results.
+        self.start()
+        workers = []
+        while True:
+            try:
+                workers.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        if not workers:
+            return []
+        with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+            return list(executor.map(lambda worker: list(self._run_on(worker, _call, (fn,) + args, None))[0],
+                                     workers))
+
+    def _run_on(self, worker, fn, args, settings):
+        cancel = current_cancel()
+        finished = False
+        task_id = next(self.task_ids)
+
+        def forward(values):
+            worker.updates.put((task_id, values))
+
+        if settings is not None:
+            settings.add_listener(forward)
+        try:
+            worker.tasks.put((task_id, fn, args, None if settings is None else settings.snapshot()))
+            while True:
+                message = worker.get(cancel)
+                if message is None:
+                    return
+                kind, value = message
+                if kind == _END:
+                    finished = True
+                    return
+                if kind == _ERROR:
+                    # The worker still sends _END after an error
+                    while worker.get()[0] != _END:
+                        pass
+                    finished = True
+                    raise RuntimeError(value)
+                yield value
+        finally:
+            if settings is not None:
+                settings.remove_listener(forward)
+            self._release(worker, finished)
+
+    def _release(self, worker, finished):
+        try:
+            if not finished:
+                # Consumer went away: stop the session and drain its output
+                worker.cancel.set()
+                while worker.get()[0] != _END:
+                    pass
+            worker.cancel.clear()
+        except RuntimeError as e:
+            logger.error(f"{str(e)}, restarting it")
+            worker.start()
+        self.idle.put(worker)
+
+    def shutdown(self):
+        with self.lock:
+            for worker in self.workers:
+                worker.cancel.set()
+                worker.tasks.put(None)
+            for worker in self.workers:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            self.workers = []
+            self.idle = queue.Queue()
+
+
+worker_pool = WorkerPool()
+
+
+def session_iterator(fn, *args, settings=None):
+    # Blocking iterator over an analysis session: in a pool worker when
+    # TA_WORKER_PROCESSES > 0, otherwise in the calling thread. fn takes the
+    # live settings as its 'settings' keyword when there are any.
+    if config.WORKER_PROCESSES > 0:
+        return worker_pool.run(fn, *args, settings=settings)
+    if settings is None:
+        return fn(*args)
+    return fn(*args, settings=settings)
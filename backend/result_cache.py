@@ -0,0 +1,181 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+import logging
+from detection_index import DetectionIndex, write_index
+import config
+
+logger = logging.getLogger(__name__)
+
+# Persistent cache for analyses of uploaded videos, shared by every process
+# through files under TA_CACHE_DIR:
+#   det-<key>/     detection index (detection_index.py) of one video, keyed
+#                  by the video's content hash, the weights file and the
+#                  detection settings that change the boxes (ROI crop,
+#                  detect stride)
+#   res-<key>.json final result of an analysis, keyed additionally by its
+#                  configuration (lines, ROI, distance)
+# Re-analyzing a video with new lines replays the cached detections and only
+# redoes tracking. Hits refresh an entry's mtime; once the directory grows
+# past TA_CACHE_MAX_BYTES the least recently used entries are deleted.
+
+
+def cache_key(*parts):
+    text = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+class ResultCache:
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or config.CACHE_DIR
+        self.max_bytes = config.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _hit(self, path):
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _write(self, name, write):
+        # Atomic: readers in other processes never see a partial file
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+
+    def load_detections(self, key):
+        # Memory-mapped DetectionIndex, or None on a miss
+        path = self._path(f"det-{key}")
+        if not self.enabled or not self._hit(path):
+            return None
+        try:
+            return DetectionIndex(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {str(e)}")
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+    def store_detections(self, key, frames, timestamps=None):
+        if not self.enabled:
+            return
+        # Written next to its final name and renamed, like single files
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(f"det-{key}")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            boxes = write_index(tmp_path, frames, timestamps)
+            if not os.path.exists(path):
+                os.replace(tmp_path, path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        logger.info(f"Cached detections of {len(frames)} frames ({boxes} boxes) as {key}")
+        self.evict()
+
+    def load_result(self, key):
+        path = self._path(f"res-{key}.json")
+        if not self.enabled or not self._hit(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def store_result(self, key, result):
+        if not self.enabled:
+            return
+        self._write(f"res-{key}.json", lambda f: f.write(json.dumps(result).encode('utf-8')))
+
+    def _size(self, path):
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.root):
+                if name.endswith('.tmp'):
+                    continue
+                path = self._path(name)
+                try:
+                    entries.append((os.stat(path).st_mtime, self._size(path), name))
+                except FileNotFoundError:
+                    continue
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path = self._path(name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+                total -= size
+                logger.info(f"Evicted {name} from the result cache")
+
+
+result_cache = ResultCache()
+
+
+class DetectionCache:
+    # Cached detections of one video for one BatchDetector configuration:
+    # replays them when present, otherwise records what the model returns
+    # and stores it once the whole video went through the detect stage.
+    # fallback_key names an index that may stand in for this one (the
+    # full-frame, every-frame index written by preprocessing).
+    def __init__(self, key, cache=None, fallback_key=None):
+        self.key = key
+        self.cache = cache or result_cache
+        self.index = self.cache.load_detections(key)
+        if self.index is None and fallback_key is not None:
+            self.index = self.cache.load_detections(fallback_key)
+        self.recorded = {}
+        self.timestamps = {}
+        if self.index is not None:
+            logger.info(f"Replaying cached detections from {self.index.path} ({len(self.index)} frames)")
+
+    @property
+    def hit(self):
+        return self.index is not None
+
+    def lookup(self, index):
+        # (found, detections) for a 1-based frame index
+        if self.index is None or index > len(self.index):
+            return False, None
+        return True, self.index.detections(index)
+
+    def record(self, index, detections, timestamp=None):
+        if self.index is None:
+            self.recorded[index] = detections
+            self.timestamps[index] = timestamp
+
+    def finish(self):
+        if self.index is not None or not self.recorded:
+            return
+        count = max(self.recorded)
+        if len(self.recorded) != count:
+            logger.warning(f"Not caching detections {self.key}: {count - len(self.recorded)} frames missing")
+            return
+        try:
+            frames = range(1, count + 1)
+            self.cache.store_detections(self.key, [self.recorded[i] for i in frames],
+                                        [self.timestamps[i] for i in frames])
+        except OSError as e:
+            logger.warning(f"Failed to cache detections {self.key}: {str(e)}")
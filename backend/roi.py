@@ -0,0 +1,60 @@
+import cv2
+import numpy as np
+
+
+class CompiledROI:
+    # A polygon ROI rasterized once per session. Point-in-polygon tests become
+    # a single lookup into a mask that covers only the polygon's bounding box.
+    def __init__(self, points):
+        # points: [{'x': .., 'y': ..}, ...], [(x, y), ...] or an (N, 2) array
+        if len(points) and isinstance(points[0], dict):
+            points = [(point['x'], point['y']) for point in points]
+        self.polygon = np.round(np.asarray(points, dtype=np.float64)).astype(np.int32).reshape(-1, 2)
+        if len(self.polygon) < 3:
+            raise ValueError("ROI needs at least 3 points")
+
+        self.x0, self.y0 = self.polygon.min(axis=0).tolist()
+        x1, y1 = self.polygon.max(axis=0).tolist()
+        self.width = x1 - self.x0 + 1
+        self.height = y1 - self.y0 + 1
+
+        self.mask = np.zeros((self.height, self.width), dtype=np.uint8)
+        cv2.fillPoly(self.mask, [self.polygon - (self.x0, self.y0)], 1)
+        self.mask = self.mask.astype(bool)
+
+    @property
+    def bounds(self):
+        # Bounding rectangle as (x, y, w, h) in frame coordinates
+        return self.x0, self.y0, self.width, self.height
+
+    def crop_rect(self, frame_shape, padding=0):
+        # Bounding rectangle grown by padding and clipped to the frame, as
+        # (x1, y1, x2, y2) with exclusive end coordinates
+        frame_h, frame_w = frame_shape[:2]
+        x1 = max(0, self.x0 - padding)
+        y1 = max(0, self.y0 - padding)
+        x2 = min(frame_w, self.x0 + self.width + padding)
+        y2 = min(frame_h, self.y0 + self.height + padding)
+        return x1, y1, x2, y2
+
+    def contains(self, xs, ys):
+        # Vectorized test for arrays of integer pixel coordinates
+        xs = np.asarray(xs, dtype=np.int64) - self.x0
+        ys = np.asarray(ys, dtype=np.int64) - self.y0
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        result = np.zeros(xs.shape, dtype=bool)
+        result[inside] = self.mask[ys[inside], xs[inside]]
+        return result
+
+    def contains_point(self, x, y):
+        return bool(self.contains([x], [y])[0])
+
+    def box_centers_inside(self, boxes):
+        # boxes: (N, >=4) array of x1, y1, x2, y2 -> boolean mask of rows
+        # whose integer center lies inside the ROI
+        boxes = np.asarray(boxes)
+        if len(boxes) == 0:
+            return np.zeros(0, dtype=bool)
+        cx = (boxes[:, 0] + boxes[:, 2]) // 2
+        cy = (boxes[:, 1] + boxes[:, 3]) // 2
+        return self.contains(cx, cy)
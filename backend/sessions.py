@@ -0,0 +1,136 @@
+import time
+import uuid
+import queue
+import threading
+import logging
+import config
+
+logger = logging.getLogger(__name__)
+
+# Per-client state that used to live in module globals (the uploaded file in
+# main.f_name, the shared tracker and current_lines in track_ip). A client
+# gets a session ID from /upload_video or from the first analysis it starts
+# and passes it back as 'session' (JSON body or query parameter). Requests
+# without one use the session of the most recent upload, which keeps the
+# single-user frontend working unchanged.
+
+
+class LiveSettings:
+    # Settings of a running analysis that can change while it streams (the
+    # counting lines). Every update bumps the version; the analysis polls
+    # changes() once per frame so an update applies from the next frame.
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+        self.version = 0
+        self.lock = threading.Lock()
+        self.listeners = []
+
+    def update(self, **values):
+        with self.lock:
+            self.values.update(values)
+            self.version += 1
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(values)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def changes(self, since):
+        # (version, values) when something changed after `since`, else None
+        with self.lock:
+            if self.version == since:
+                return None
+            return self.version, dict(self.values)
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+
+class RemoteSettings(LiveSettings):
+    # Copy of a LiveSettings inside a pool worker process, fed with the
+    # (task_id, values) updates the server process forwards through a queue.
+    # Leftover updates addressed to an earlier task are skipped.
+    def __init__(self, values, updates, task_id):
+        super().__init__(values)
+        self.updates = updates
+        self.task_id = task_id
+
+    def changes(self, since):
+        while True:
+            try:
+                task_id, values = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            if task_id != self.task_id:
+                continue
+            with self.lock:
+                self.values.update(values)
+                self.version += 1
+        return super().changes(since)
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        # Uploaded video analyzed by /Count, /Wrong and /Speed
+        self.video_path = None
+        # Live settings of the session's current count analysis
+        self.settings = None
+        self.last_used = time.monotonic()
+
+    def start_analysis(self, **values):
+        # Fresh settings for a new analysis; /update_lines reaches this one
+        self.settings = LiveSettings(values)
+        return self.settings
+
+
+class SessionManager:
+    def __init__(self, ttl=None):
+        self.ttl = config.SESSION_TTL if ttl is None else ttl
+        self.sessions = {}
+        self.default_id = None
+        self.lock = threading.Lock()
+
+    def create(self, session_id=None):
+        session = Session(session_id or uuid.uuid4().hex)
+        with self.lock:
+            self._expire()
+            self.sessions[session.id] = session
+            if self.default_id is None:
+                self.default_id = session.id
+        return session
+
+    def get(self, session_id):
+        # Session by ID (None for an unknown ID); without an ID the session
+        # of the most recent upload
+        with self.lock:
+            session = self.sessions.get(session_id or self.default_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+            return session
+
+    def get_or_create(self, session_id=None):
+        return self.get(session_id) or self.create(session_id)
+
+    def set_default(self, session):
+        with self.lock:
+            self.default_id = session.id
+
+    def _expire(self):
+        if not self.ttl:
+            return
+        cutoff = time.monotonic() - self.ttl
+        for session_id in [s.id for s in self.sessions.values() if s.last_used < cutoff]:
+            if session_id != self.default_id:
+                del self.sessions[session_id]
+
+
+session_manager = SessionManager()
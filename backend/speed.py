@@ -1,12 +1,18 @@
 import cv2
 import numpy as np
-from ultralytics import YOLO
-from tracker import Tracker
-import os
-import time
-import base64
-import json
-import base64
+import logging
+import traceback
+from tracker import create_tracker
+from roi import CompiledROI
+from options import AnalysisOptions
+from pipeline import Pipeline, Stage
+from workers import iterate_in_thread
+from process_pool import session_iterator
+from video_store import video_store
+from vehicle_state import VehicleStore
+import config
+
+logger = logging.getLogger(__name__)
 
 
 def get_perspective_transform(frame, src_points):
@@ -17,59 +23,119 @@ def get_perspective_transform(frame, src_points):
 def apply_perspective_transform(frame, matrix):
     return cv2.warpPerspective(frame, matrix, (500, 500))
 
-def point_inside_polygon(x, y, poly):
-    n = len(poly)
-    inside = False
-    p1x, p1y = poly[0]
-    for i in range(1, n + 1):
-        p2x, p2y = poly[i % n]
-        if y > min(p1y, p2y):
-            if y <= max(p1y, p2y):
-                if x <= max(p1x, p2x):
-                    if p1y != p2y:
-                        xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
-                    if p1x == p2x or x <= xinters:
-                        inside = not inside
-        p1x, p1y = p2x, p2y
-    return inside
-
-
-async def process_speed_detection(video_path, roi_points, distance_meters):
-    model = YOLO('yolov8l.pt')
-    tracker = Tracker()
-    vehicle_data = {}
-
-    cap = cv2.VideoCapture(video_path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-    perspective_matrix = get_perspective_transform(None, roi_points)
-
-    frame_count = 0
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_count += 1
-
-        results = model(frame)
-        detections = results[0].boxes.data.cpu().numpy()
-        detected_objects = []
-        for det in detections:
-            x1, y1, x2, y2, conf, class_id = det
-            if int(class_id) in [2, 3, 5, 7]:  # car, motorcycle, bus, truck
-                detected_objects.append([int(x1), int(y1), int(x2), int(y2)])
-
-        bbox_id = tracker.update(detected_objects)
-
-        warped_frame = apply_perspective_transform(frame, perspective_matrix)
+# COCO class ids of car, motorcycle, bus and truck
+SPEED_CLASS_IDS = [2, 3, 5, 7]
+# Side of the bird's-eye square the ROI is mapped to; distance_meters spans it
+BIRDSEYE_SIZE = 500
+
+
+class SpeedEstimator:
+    # Bird's-eye speeds of all tracks of a frame at once: one
+    # perspectiveTransform for every box center, displacements and speeds as
+    # arrays, smoothed per track by the VehicleStore filter. Elapsed time
+    # comes from the frames' presentation timestamps; fps is only the
+    # fallback for packets without one.
+    def __init__(self, roi_points, distance_meters, fps, vehicles=None):
+        self.matrix = get_perspective_transform(None, roi_points)
+        self.distance_meters = distance_meters
+        self.fps = fps
+        self.vehicles = vehicles if vehicles is not None else VehicleStore()
+
+    def update(self, tracks, frame_index, timestamp=None):
+        # tracks: [[x1, y1, x2, y2, id], ...]. Returns (speeds in km/h, NaN
+        # until a vehicle was seen twice; bird's-eye points), one per track.
+        if timestamp is None:
+            # Without a timestamp or a known fps no time has elapsed (NaN),
+            # so vehicles are followed but get no speeds
+            timestamp = (frame_index - 1) / self.fps if self.fps and self.fps > 0 else np.nan
+        if not len(tracks):
+            return np.zeros(0), np.zeros((0, 2), dtype=np.float32)
+        data = np.asarray(tracks, dtype=np.int64)
+        centers = (data[:, :2] + data[:, 2:4]) // 2
+        points = cv2.perspectiveTransform(centers.astype(np.float32).reshape(-1, 1, 2), self.matrix).reshape(-1, 2)
+
+        vehicles = self.vehicles
+        slots, new = vehicles.slots_for(data[:, 4].tolist())
+        elapsed = timestamp - vehicles.last_time[slots]
+        moved = ~new & (elapsed > 0)
+        if moved.any():
+            seen = slots[moved]
+            displacement = points[moved] - vehicles.position[seen]
+            distance = np.hypot(displacement[:, 0], displacement[:, 1])
+            seconds = elapsed[moved]
+            vehicles.add_speeds(seen, (distance / BIRDSEYE_SIZE) * (self.distance_meters / seconds) * 3.6)
+        vehicles.position[slots] = points
+        vehicles.last_seen[slots] = frame_index
+        vehicles.last_time[slots] = timestamp
+        return vehicles.speed_estimates(slots), points
+
+
+class SpeedAnalyzer:
+    def __init__(self, roi_points, distance_meters, fps, debug_view=False):
+        self.tracker = create_tracker()
+        self.vehicles = VehicleStore()
+        self.roi_points = roi_points
+        # Speeds are only meaningful inside the calibrated ROI
+        self.roi = CompiledROI(roi_points)
+        self.distance_meters = distance_meters
+        self.fps = fps
+        self.estimator = SpeedEstimator(roi_points, distance_meters, fps, self.vehicles)
+        self.perspective_matrix = self.estimator.matrix
+        # Inset the warped bird's-eye view into annotated frames
+        self.debug_view = debug_view
+
+    def keep(self, detections):
+        # Vehicles inside the calibrated ROI
+        return np.isin(detections[:, 5].astype(int), SPEED_CLASS_IDS) & self.roi.box_centers_inside(detections)
+
+    def track(self, packet):
+        # Track stage: update IDs and per-vehicle speed estimates
+        vehicles = self.vehicles
+        frame_count = packet.index
+
+        bbox_id, _ = self.tracker.track(packet.detections, self.keep)
+        speeds, points = self.estimator.update(bbox_id, frame_count, packet.timestamp)
+        tracks = [(x1, y1, x2, y2, obj_id, None if np.isnan(speed) else speed)
+                  for (x1, y1, x2, y2, obj_id), speed in zip(bbox_id, speeds.tolist())]
+
+        removed = vehicles.evict(frame_count)
+        packet.result = {'tracks': tracks, 'birdseye': points}
+        # Only vehicles whose average changed this frame, and the ones that
+        # were forgotten; clients keep the rest from earlier frames
+        changed = list(vehicles.take_changes())
+        estimates = vehicles.speed_estimates([vehicles.slots[obj_id] for obj_id in changed]).tolist()
+        packet.payload['vehicle_data'] = {obj_id: {'avg_speed': speed} for obj_id, speed in zip(changed, estimates)}
+        if removed:
+            packet.payload['vehicles_removed'] = removed
+        return packet
+
+    def describe(self, packet):
+        # Per-frame detail for metadata-only output
+        return {'tracks': [[x1, y1, x2, y2, obj_id, None if avg_speed is None else round(float(avg_speed), 2)]
+                           for x1, y1, x2, y2, obj_id, avg_speed in packet.result['tracks']]}
+
+    def summary(self):
+        # Per-vehicle speeds over the whole video (km/h)
+        return {'vehicle_speeds': {
+            obj_id: {'avg_speed': total / samples, 'max_speed': peak, 'samples': samples}
+            for obj_id, (total, peak, samples) in self.vehicles.speed_totals().items()
+        }}
+
+    def draw_debug_view(self, frame, points):
+        # Warped bird's-eye view with the tracked centers, inset top right
+        warped = apply_perspective_transform(frame, self.perspective_matrix)
+        for x, y in np.round(points).astype(int).tolist():
+            cv2.circle(warped, (x, y), 6, (0, 0, 255), -1)
+        size = min(frame.shape[0], frame.shape[1]) // 3
+        frame[:size, -size:] = cv2.resize(warped, (size, size))
+
+    def annotate(self, packet):
+        frame = packet.frame
+        roi_points = self.roi_points
 
         # Create a copy of the frame for the transparent overlay
         overlay = frame.copy()
-        
+
         # Draw filled purple ROI with 40% opacity
         cv2.fillPoly(overlay, [np.int32(roi_points)], (128, 0, 128))
         cv2.addWeighted(overlay, 0.4, frame, 0.6, 0, frame)
@@ -77,58 +143,48 @@ async def process_speed_detection(video_path, roi_points, distance_meters):
         # Draw ROI outline
         cv2.polylines(frame, [np.int32(roi_points)], True, (128, 0, 128), 2)
 
-        for bbox in bbox_id:
-            x1, y1, x2, y2, obj_id = bbox
-            cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
-
-            # Transform the center point to bird's eye view
-            transformed_point = cv2.perspectiveTransform(np.array([[[cx, cy]]], dtype=np.float32), perspective_matrix)
-            tx, ty = transformed_point[0][0]
-
-            if obj_id not in vehicle_data:
-                vehicle_data[obj_id] = {
-                    'last_x': None,
-                    'last_y': None,
-                    'last_frame': None,
-                    'speeds': [],
-                    'avg_speed': None
-                }
-
-            if vehicle_data[obj_id]['last_frame'] is not None:
-                if frame_count != vehicle_data[obj_id]['last_frame']:
-                    dx = tx - vehicle_data[obj_id]['last_x']
-                    dy = ty - vehicle_data[obj_id]['last_y']
-                    distance = np.sqrt(dx**2 + dy**2)
-                    time = (frame_count - vehicle_data[obj_id]['last_frame']) / fps
-                    speed = (distance / 500) * (distance_meters / time) * 3.6  # km/h
-
-                    vehicle_data[obj_id]['speeds'].append(speed)
-                    if len(vehicle_data[obj_id]['speeds']) > 5:
-                        vehicle_data[obj_id]['avg_speed'] = np.mean(vehicle_data[obj_id]['speeds'][-5:])
-                    else:
-                        vehicle_data[obj_id]['avg_speed'] = np.mean(vehicle_data[obj_id]['speeds'])
-
-            vehicle_data[obj_id]['last_x'] = tx
-            vehicle_data[obj_id]['last_y'] = ty
-            vehicle_data[obj_id]['last_frame'] = frame_count
-
+        for x1, y1, x2, y2, obj_id, avg_speed in packet.result['tracks']:
             # Display ID and average speed for all detected vehicles
             cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
             cv2.putText(frame, f"ID: {obj_id}", (x1, y1 - 35), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-            
-            if vehicle_data[obj_id]['avg_speed'] is not None:
-                displayed_speed = 0 if vehicle_data[obj_id]['avg_speed'] < 5 else vehicle_data[obj_id]['avg_speed']
+
+            if avg_speed is not None:
+                displayed_speed = 0 if avg_speed < 5 else avg_speed
                 speed_text = f"{displayed_speed:.2f} km/h"
                 cv2.putText(frame, speed_text, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
 
-        # Encode the frame as JPEG
-        _, buffer = cv2.imencode('.jpg', frame)
-        frame_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # Yield the frame and vehicle data as a JSON object
-        yield json.dumps({
-            'frame': frame_base64,
-            'vehicle_data': {k: {'avg_speed': v['avg_speed']} for k, v in vehicle_data.items() if v['avg_speed'] is not None}
-        }) + '\n'
-
-    cap.release()
\ No newline at end of file
+        if self.debug_view:
+            self.draw_debug_view(frame, packet.result['birdseye'])
+        return packet
+
+
+def build_speed_pipeline(cap, analyzer, options, name="speed", video=None):
+    batch_detector = options.batch_detector(config.SPEED_MODEL, roi=analyzer.roi, video=video)
+    source, detect = options.detection_source(cap, batch_detector)
+    return Pipeline(source, [
+        *detect,
+        Stage('track', analyzer.track),
+        *options.output_stages(analyzer.annotate, analyzer.describe),
+    ], name=name)
+
+
+def speed_frames(video_path, roi_points, distance_meters, options=None):
+    options = options or AnalysisOptions()
+    try:
+        cap = cv2.VideoCapture(video_path)
+        # Probed once at upload time
+        video = video_store.metadata(video_path)
+
+        analyzer = SpeedAnalyzer(roi_points, distance_meters, video['fps'], options.debug_view)
+        yield from build_speed_pipeline(cap, analyzer, options, video=video).run()
+    except Exception as e:
+        logger.error(f"Error in speed_frames: {str(e)}")
+        logger.error(f"Error details: {traceback.format_exc()}")
+        yield options.format_error(str(e))
+
+
+async def process_speed_detection(video_path, roi_points, distance_meters, options=None):
+    async for frame_data in iterate_in_thread(
+        lambda: session_iterator(speed_frames, video_path, roi_points, distance_meters, options)
+    ):
+        yield frame_data
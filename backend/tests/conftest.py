@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Backend modules are imported flat, as when running from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Uploads and cache entries of the tests go to a scratch directory
+_scratch = tempfile.mkdtemp(prefix='traffic-tests-')
+os.environ.setdefault('TA_UPLOAD_DIR', os.path.join(_scratch, 'uploads'))
+os.environ.setdefault('TA_CACHE_DIR', os.path.join(_scratch, 'cache'))
+os.environ.setdefault('TA_PRELOAD_MODELS', '0')
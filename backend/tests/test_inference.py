@@ -0,0 +1,37 @@
+import numpy as np
+from inference import BatchDetector, EMPTY_DETECTIONS
+from pipeline import FramePacket
+from roi import CompiledROI
+
+
+def test_roi_outside_the_frame_detects_nothing():
+    detector = BatchDetector('unused.pt', roi=CompiledROI([(2000, 2000), (2100, 2000), (2100, 2100)]))
+    calls = []
+    detector.detect = lambda frames: calls.append(frames) or []
+    frame = np.zeros((360, 640, 3), dtype=np.uint8)
+    assert [len(d) for d in detector.detect_frames([frame, frame])] == [0, 0]
+    assert calls == [[]]
+
+
+def test_only_frames_with_a_crop_reach_the_model():
+    detector = BatchDetector('unused.pt', roi=CompiledROI([(10, 10), (100, 10), (100, 100)]))
+    box = np.array([[1, 2, 11, 12, 0.9, 2]], dtype=np.float32)
+    detector.detect = lambda frames: [box for _ in frames]
+    frames = [np.zeros((360, 640, 3), dtype=np.uint8), np.zeros((5, 5, 3), dtype=np.uint8)]
+    first, second = detector.detect_frames(frames)
+    assert first[0, :4].tolist() == [11, 12, 21, 22]
+    assert second is EMPTY_DETECTIONS
+
+
+def test_replay_applies_the_stride_and_reports_throughput():
+    detector = BatchDetector('unused.pt', detect_stride=3)
+    packets = []
+    for index in range(1, 7):
+        packet = FramePacket(index, None, timestamp=(index - 1) / 25)
+        packet.detections = EMPTY_DETECTIONS
+        packets.append(detector.replay_packet(packet))
+    assert [p.detections is not None for p in packets] == [True, False, False, True, False, False]
+    throughput = packets[-1].payload['throughput']
+    assert throughput['detect_stride'] == 3
+    assert throughput['inference_fps'] == 0.0
+    assert detector.frames_replayed == 2 and detector.frames_seen == 6
@@ -0,0 +1,29 @@
+import json
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+import main
+
+LINES = [{'startX': 0, 'startY': 150, 'endX': 600, 'endY': 150}]
+
+
+@pytest.fixture
+def video_bytes(tmp_path):
+    # A few frames of a valid video, so only the job config can be rejected
+    path = str(tmp_path / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (64, 48))
+    for _ in range(5):
+        writer.write(np.zeros((48, 64, 3), dtype=np.uint8))
+    writer.release()
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('tuning', [{'batch_size': 'abc'}, {'batch_size': 0}, {'batch_max_wait': 'soon'}])
+def test_job_with_bad_batch_settings_is_rejected(video_bytes, tuning):
+    client = TestClient(main.app)
+    job_config = json.dumps(dict({'mode': 'count', 'lines': LINES}, **tuning))
+    response = client.post('/jobs', files={'file': ('clip.avi', video_bytes)}, data={'config': job_config})
+    assert response.status_code == 400
+    assert not main.job_manager.list()
@@ -0,0 +1,19 @@
+import pytest
+from options import AnalysisOptions
+
+
+@pytest.mark.parametrize('field, value', [
+    ('batch_size', 'abc'),
+    ('batch_size', 0),
+    ('batch_max_wait', 'soon'),
+    ('batch_max_wait', -1),
+])
+def test_bad_batch_settings_are_rejected(field, value):
+    with pytest.raises(ValueError):
+        AnalysisOptions.from_request({field: value})
+
+
+def test_batch_settings_are_converted():
+    options = AnalysisOptions.from_request({'batch_size': '4', 'batch_max_wait': '0.05'})
+    assert options.batch_size == 4
+    assert options.batch_max_wait == 0.05
@@ -0,0 +1,56 @@
+import threading
+import time
+from pipeline import FramePacket, LatestQueue, Pipeline, Stage, cancel_on
+
+
+def packet(index, **payload):
+    packet = FramePacket(index, None)
+    packet.payload.update(payload)
+    return packet
+
+
+def test_latest_queue_carries_deltas_of_dropped_packets():
+    q = LatestQueue()
+    q.put(packet(1, vehicle_data={1: {'avg_speed': 40.0}, 2: {'avg_speed': 50.0}}, counts={'a': 1}))
+    q.put(packet(2, vehicles_removed=[2]))
+    q.put(packet(3, vehicle_data={1: {'avg_speed': 42.0}}, counts={'a': 2}))
+    latest = q.get_nowait()
+    assert latest.index == 3
+    assert latest.payload['vehicle_data'] == {1: {'avg_speed': 42.0}, 2: {'avg_speed': 50.0}}
+    assert latest.payload['vehicles_removed'] == [2]
+    assert latest.payload['counts'] == {'a': 2}
+
+
+class SilentSource:
+    # Live source whose camera is down: yields nothing until stopped
+    def __init__(self):
+        self.stopped = threading.Event()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.stopped.wait(60):
+            raise StopIteration
+
+    def stop(self):
+        self.stopped.set()
+
+
+def test_cancel_stops_a_pipeline_waiting_for_input():
+    source = SilentSource()
+    cancel = threading.Event()
+    items = []
+
+    def consume():
+        with cancel_on(cancel):
+            items.extend(Pipeline(source, [Stage('identity', lambda packet: packet)], name='test').run())
+
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    time.sleep(0.3)
+    cancel.set()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert source.stopped.is_set()
+    assert items == []
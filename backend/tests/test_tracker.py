@@ -0,0 +1,29 @@
+import pytest
+from tracker import Tracker
+
+
+def fast_box(frame, speed=10):
+    # 40x30 box moving right by `speed` px per frame
+    x = 20 + speed * frame
+    return [x, 100, x + 40, 130]
+
+
+@pytest.mark.parametrize('stride', [1, 2, 3, 4, 6])
+@pytest.mark.parametrize('max_lost', [0, 5])
+def test_fast_box_keeps_its_id_across_strides(stride, max_lost):
+    tracker = Tracker(max_lost=max_lost)
+    ids = set()
+    for frame in range(60):
+        if frame % stride:
+            tracks = tracker.predict()
+        else:
+            tracks = tracker.update([fast_box(frame)])
+        ids.update(track[4] for track in tracks)
+    assert ids == {0}
+
+
+def test_distant_detection_gets_a_new_id():
+    tracker = Tracker()
+    tracker.update([fast_box(0)])
+    tracks = tracker.update([[500, 400, 540, 430]])
+    assert tracks[0][4] == 1
@@ -1,50 +1,150 @@
-import math
+import numpy as np
+import config
 
 
 class Tracker:
-    def __init__(self):
-        # Store the center positions of the objects
-        self.center_points = {}
+    def __init__(self, max_distance=35, max_lost=0, lost_gate=None, velocity_smoothing=0.5):
+        # Maximum center distance (px) for a detection to keep an existing ID
+        self.max_distance = max_distance
+        # Frames an unmatched track is kept before its ID is dropped. With
+        # max_lost > 0 tracks are matched against their constant-velocity
+        # predicted position instead of their last seen one.
+        self.max_lost = max_lost
+        # Matching gate (px) for tracks that missed at least one frame
+        self.lost_gate = lost_gate if lost_gate is not None else max_distance * 1.5
+        # Weight of the newest displacement in the velocity estimate
+        self.velocity_smoothing = velocity_smoothing
+
+        # Per-track state: ID, last seen center, velocity (px/frame), box size,
+        # missed detection frames (lost) and frames since last seen (age)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.centers = np.zeros((0, 2), dtype=np.float64)
+        self.velocities = np.zeros((0, 2), dtype=np.float64)
+        self.sizes = np.zeros((0, 2), dtype=np.float64)
+        self.lost = np.zeros(0, dtype=np.int64)
+        self.age = np.zeros(0, dtype=np.int64)
+        self.observed = np.zeros(0, dtype=bool)
+
         # Keep the count of the IDs
         # each time a new object id detected, the count will increase by one
         self.id_count = 0
 
+    @property
+    def persistent(self):
+        return self.max_lost > 0
+
+    @property
+    def center_points(self):
+        return {int(i): (float(c[0]), float(c[1])) for i, c in zip(self.ids, self.centers)}
+
+    def predicted_centers(self):
+        if not self.persistent:
+            return self.centers
+        return self.centers + self.velocities * (self.age + 1)[:, None]
+
+    def predict(self):
+        # Advance one frame without detections (frames skipped by the detect
+        # stride) and return the propagated boxes of the visible tracks in the
+        # same [x1, y1, x2, y2, id] form as update(). Lost tracks stay hidden
+        # and skipped frames do not count towards max_lost.
+        centers = self.predicted_centers()
+        self.age = self.age + 1
+        visible = self.lost == 0
+        half = self.sizes[visible] / 2
+        tl = np.round(centers[visible] - half).astype(int)
+        br = np.round(centers[visible] + half).astype(int)
+        return [[x1, y1, x2, y2, obj_id] for (x1, y1), (x2, y2), obj_id
+                in zip(tl.tolist(), br.tolist(), self.ids[visible].tolist())]
+
+    def _match(self, centers):
+        # Global greedy assignment: the closest (detection, track) pair inside
+        # the gate is matched first, so the result does not depend on the
+        # order of the detections. Returns the matched track index per detection.
+        matches = np.full(len(centers), -1, dtype=np.int64)
+        if len(self.ids) == 0 or len(centers) == 0:
+            return matches
+
+        predicted = self.predicted_centers()
+        dx = centers[:, 0, None] - predicted[None, :, 0]
+        dy = centers[:, 1, None] - predicted[None, :, 1]
+        dist_sq = dx * dx + dy * dy
+        # Tracks coasting through skipped frames may have moved max_distance
+        # per frame since they were last seen
+        gate = np.where(self.lost > 0, self.lost_gate, self.max_distance * (self.age + 1))
+        det_idx, trk_idx = np.nonzero(dist_sq < (gate * gate)[None, :])
+        if len(det_idx) == 0:
+            return matches
+
+        order = np.argsort(dist_sq[det_idx, trk_idx], kind='stable')
+        matched = {}
+        used_tracks = set()
+        for d, t in zip(det_idx[order].tolist(), trk_idx[order].tolist()):
+            if d in matched or t in used_tracks:
+                continue
+            matched[d] = t
+            used_tracks.add(t)
+
+        matches[list(matched)] = list(matched.values())
+        return matches
 
     def update(self, objects_rect):
-        # Objects boxes and ids
-        objects_bbs_ids = []
-
-        # Get center point of new object
-        for rect in objects_rect:
-            x, y, w, h = rect
-            cx = (x + x + w) // 2
-            cy = (y + y + h) // 2
-
-            # Find out if that object was detected already
-            same_object_detected = False
-            for id, pt in self.center_points.items():
-                dist = math.hypot(cx - pt[0], cy - pt[1])
-
-                if dist < 35:
-                    self.center_points[id] = (cx, cy)
-#                    print(self.center_points)
-                    objects_bbs_ids.append([x, y, w, h, id])
-                    same_object_detected = True
-                    break
-
-            # New object is detected we assign the ID to that object
-            if same_object_detected is False:
-                self.center_points[self.id_count] = (cx, cy)
-                objects_bbs_ids.append([x, y, w, h, self.id_count])
-                self.id_count += 1
-
-        # Clean the dictionary by center points to remove IDS not used anymore
-        new_center_points = {}
-        for obj_bb_id in objects_bbs_ids:
-            _, _, _, _, object_id = obj_bb_id
-            center = self.center_points[object_id]
-            new_center_points[object_id] = center
-
-        # Update dictionary with IDs not used removed
-        self.center_points = new_center_points.copy()
-        return objects_bbs_ids
\ No newline at end of file
+        # objects_rect: [[x1, y1, x2, y2], ...] -> [[x1, y1, x2, y2, id], ...]
+        rects = np.asarray(objects_rect, dtype=np.float64).reshape(-1, 4)
+        centers = (rects[:, :2] + rects[:, 2:]) // 2
+        sizes = rects[:, 2:] - rects[:, :2]
+
+        matches = self._match(centers)
+        matched = matches >= 0
+        track_idx = matches[matched]
+
+        # Velocity of matched tracks from the displacement since last seen
+        velocities = np.zeros_like(centers)
+        if self.persistent and len(track_idx):
+            steps = (self.age[track_idx] + 1)[:, None]
+            measured = (centers[matched] - self.centers[track_idx]) / steps
+            alpha = self.velocity_smoothing
+            previous = self.velocities[track_idx]
+            seen_before = self.observed[track_idx][:, None]
+            velocities[matched] = np.where(seen_before, alpha * measured + (1 - alpha) * previous, measured)
+
+        ids = np.empty(len(centers), dtype=np.int64)
+        ids[matched] = self.ids[track_idx]
+
+        # New objects get fresh IDs
+        n_new = int((~matched).sum())
+        ids[~matched] = np.arange(self.id_count, self.id_count + n_new)
+        self.id_count += n_new
+
+        # Unmatched tracks stay in the lost buffer for up to max_lost frames
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[track_idx] = False
+        keep &= self.lost < self.max_lost
+
+        observed = np.zeros(len(centers), dtype=bool)
+        observed[matched] = True
+
+        self.ids = np.concatenate([ids, self.ids[keep]])
+        self.centers = np.concatenate([centers, self.centers[keep]])
+        self.velocities = np.concatenate([velocities, self.velocities[keep]])
+        self.sizes = np.concatenate([sizes, self.sizes[keep]])
+        self.lost = np.concatenate([np.zeros(len(centers), dtype=np.int64), self.lost[keep] + 1])
+        self.age = np.concatenate([np.zeros(len(centers), dtype=np.int64), self.age[keep] + 1])
+        self.observed = np.concatenate([observed, self.observed[keep]])
+
+        return [[*rect, obj_id] for rect, obj_id in zip(objects_rect, ids.tolist())]
+
+    def track(self, detections, keep):
+        # Track step of an analyzer for one packet's detections (BatchDetector
+        # rows): update() with the rows the `keep` mask function selects, or
+        # predict() for frames skipped by detect_stride (detections is None).
+        # Returns (tracks, boxes that went into them).
+        if detections is None:
+            tracks = self.predict()
+            return tracks, [track[:4] for track in tracks]
+        boxes = detections[keep(detections), :4].astype(int).tolist()
+        return self.update(boxes), boxes
+
+
+def create_tracker():
+    # Tracker configured from the TA_TRACK_* settings
+    return Tracker(max_lost=config.TRACK_MAX_LOST, lost_gate=config.TRACK_LOST_GATE)
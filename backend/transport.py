@@ -0,0 +1,72 @@
+import json
+import base64
+
+# How encoded frames leave the server:
+#   json      - one JSON line per frame with the JPEG base64-encoded inside
+#               (the original format, kept as the default)
+#   mjpeg     - multipart/x-mixed-replace: per frame a small application/json
+#               part with the metadata followed by the raw image/jpeg part
+#   websocket - (metadata JSON text, raw JPEG bytes) pairs for /ws, sent as a
+#               text message followed by a binary message
+JSON = 'json'
+MJPEG = 'mjpeg'
+WEBSOCKET = 'websocket'
+TRANSPORTS = (JSON, MJPEG, WEBSOCKET)
+
+BOUNDARY = 'frame'
+
+
+def media_type(transport, default):
+    if transport == MJPEG:
+        return f"multipart/x-mixed-replace; boundary={BOUNDARY}"
+    return default
+
+
+def _part(content_type, body):
+    header = f"--{BOUNDARY}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n"
+    return header.encode('ascii') + body + b"\r\n"
+
+
+def format_json(packet):
+    data = {'frame': base64.b64encode(packet.jpeg).decode('ascii')}
+    data.update(packet.payload)
+    return json.dumps(data) + '\n'
+
+
+def format_mjpeg(packet):
+    metadata = json.dumps(packet.payload, separators=(',', ':')).encode('utf-8')
+    return _part('application/json', metadata) + _part('image/jpeg', packet.jpeg)
+
+
+def format_websocket(packet):
+    return json.dumps(packet.payload, separators=(',', ':')), packet.jpeg
+
+
+FORMATTERS = {
+    JSON: format_json,
+    MJPEG: format_mjpeg,
+    WEBSOCKET: format_websocket,
+}
+
+
+def format_metadata(transport, packet, detail):
+    # Metadata-only output: one compact JSON object per frame, no image
+    data = {'frame_index': packet.index}
+    data.update(detail)
+    data.update(packet.payload)
+    text = json.dumps(data, separators=(',', ':'))
+    if transport == WEBSOCKET:
+        return text, None
+    return text + '\n'
+
+
+def formatter(transport):
+    return FORMATTERS[transport]
+
+
+def format_error(transport, message):
+    if transport == MJPEG:
+        return _part('application/json', json.dumps({"error": message}).encode('utf-8'))
+    if transport == WEBSOCKET:
+        return json.dumps({"error": message}), None
+    return json.dumps({"error": message}) + '\n'
@@ -0,0 +1,142 @@
+import numpy as np
+import config
+
+# Per-vehicle state of the speed and wrong-way analyses. Instead of a dict of
+# dicts per track ID, every field is a column in a preallocated NumPy array
+# and a vehicle owns one row (slot). Speeds are kept in a fixed-size ring
+# buffer per vehicle, plus running totals for the final summary. Vehicles not
+# seen for max_age frames are evicted and their slots reused, so the store
+# only grows with the number of vehicles in view, however long a stream runs.
+#
+# The reported speed of a vehicle is filtered per track: an exponential
+# moving average with alpha = 2 / (history + 1) ('ema'), or the plain mean of
+# the ring buffer ('window').
+
+FILTERS = ('ema', 'window')
+
+# Bits of the flags column (wrong-way analysis)
+TOUCHED_GREEN = 1
+TOUCHED_RED = 2
+WRONG_WAY = 4
+
+
+class VehicleStore:
+    def __init__(self, max_age=None, history=None, capacity=64, speed_filter=None):
+        self.max_age = config.VEHICLE_MAX_AGE if max_age is None else max_age
+        self.history = config.SPEED_HISTORY if history is None else history
+        self.speed_filter = speed_filter or config.SPEED_FILTER
+        if self.speed_filter not in FILTERS:
+            raise ValueError(f"Unknown speed filter '{self.speed_filter}', expected one of {', '.join(FILTERS)}")
+        self.alpha = 2.0 / (self.history + 1)
+        # Track ID -> slot, and slots freed by eviction
+        self.slots = {}
+        self.free = list(range(capacity - 1, -1, -1))
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.last_seen = np.zeros(capacity, dtype=np.int64)
+        # Presentation time (seconds) of the frame the position was taken at
+        self.last_time = np.zeros(capacity, dtype=np.float64)
+        self.position = np.zeros((capacity, 2), dtype=np.float64)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        # Ring buffer of the latest speeds and running totals
+        self.speeds = np.zeros((capacity, self.history), dtype=np.float64)
+        self.samples = np.zeros(capacity, dtype=np.int64)
+        self.speed_sum = np.zeros(capacity, dtype=np.float64)
+        self.speed_max = np.zeros(capacity, dtype=np.float64)
+        self.smoothed = np.zeros(capacity, dtype=np.float64)
+        # Speed totals of evicted vehicles: ID -> (sum, max, samples)
+        self.finished = {}
+        # IDs whose average speed changed since the last take_changes()
+        self.changed = set()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _grow(self):
+        capacity = len(self.ids)
+        for name in ('ids', 'last_seen', 'last_time', 'position', 'flags', 'speeds', 'samples', 'speed_sum', 'speed_max',
+                     'smoothed'):
+            column = getattr(self, name)
+            grown = np.zeros((capacity * 2,) + column.shape[1:], dtype=column.dtype)
+            grown[:capacity] = column
+            setattr(self, name, grown)
+        self.ids[capacity:] = -1
+        self.free.extend(range(capacity * 2 - 1, capacity - 1, -1))
+
+    def slot(self, obj_id):
+        # (slot, is_new) of a vehicle, allocating a cleared row for a new one
+        slot = self.slots.get(obj_id)
+        if slot is not None:
+            return slot, False
+        if not self.free:
+            self._grow()
+        slot = self.free.pop()
+        self.slots[obj_id] = slot
+        self.ids[slot] = obj_id
+        self.flags[slot] = 0
+        self.samples[slot] = 0
+        self.speed_sum[slot] = 0.0
+        self.speed_max[slot] = 0.0
+        return slot, True
+
+    def slots_for(self, obj_ids):
+        # slot() for every ID: (slots array, is_new mask)
+        pairs = [self.slot(obj_id) for obj_id in obj_ids]
+        slots = np.fromiter((slot for slot, _ in pairs), dtype=np.int64, count=len(pairs))
+        new = np.fromiter((is_new for _, is_new in pairs), dtype=bool, count=len(pairs))
+        return slots, new
+
+    def add_speeds(self, slots, speeds):
+        # One new speed sample for each of the (distinct) slots
+        first = self.samples[slots] == 0
+        self.speeds[slots, self.samples[slots] % self.history] = speeds
+        self.samples[slots] += 1
+        self.speed_sum[slots] += speeds
+        self.speed_max[slots] = np.maximum(self.speed_max[slots], speeds)
+        self.smoothed[slots] = np.where(first, speeds, self.alpha * speeds + (1 - self.alpha) * self.smoothed[slots])
+        self.changed.update(self.ids[slots].tolist())
+
+    def speed_estimates(self, slots):
+        # Filtered speed of each slot, NaN before its first sample
+        slots = np.asarray(slots, dtype=np.int64)
+        samples = self.samples[slots]
+        if self.speed_filter == 'ema':
+            estimates = self.smoothed[slots].copy()
+        else:
+            # The ring fills from column 0, so the first `count` are valid
+            count = np.minimum(samples, self.history)
+            valid = np.arange(self.history) < count[:, None]
+            estimates = (self.speeds[slots] * valid).sum(axis=1) / np.maximum(count, 1)
+        estimates[samples == 0] = np.nan
+        return estimates
+
+    def evict(self, frame):
+        # Drops vehicles last seen more than max_age frames before `frame`;
+        # returns their IDs
+        stale = np.nonzero((self.ids >= 0) & (self.last_seen < frame - self.max_age))[0]
+        removed = []
+        for slot in stale.tolist():
+            obj_id = int(self.ids[slot])
+            if self.samples[slot]:
+                total, peak, count = self.finished.get(obj_id, (0.0, 0.0, 0))
+                self.finished[obj_id] = (total + float(self.speed_sum[slot]), max(peak, float(self.speed_max[slot])),
+                                         count + int(self.samples[slot]))
+            del self.slots[obj_id]
+            self.ids[slot] = -1
+            self.free.append(slot)
+            self.changed.discard(obj_id)
+            removed.append(obj_id)
+        return removed
+
+    def take_changes(self):
+        changed, self.changed = self.changed, set()
+        return changed
+
+    def speed_totals(self):
+        # ID -> (sum, max, samples) of every vehicle with speeds, evicted or not
+        totals = dict(self.finished)
+        for obj_id, slot in self.slots.items():
+            if self.samples[slot]:
+                total, peak, count = totals.get(obj_id, (0.0, 0.0, 0))
+                totals[obj_id] = (total + float(self.speed_sum[slot]), max(peak, float(self.speed_max[slot])),
+                                  count + int(self.samples[slot]))
+        return totals
@@ -0,0 +1,234 @@
+import os
+import json
+import asyncio
+import time
+import uuid
+import hashlib
+import threading
+import logging
+import cv2
+import config
+
+logger = logging.getLogger(__name__)
+
+# Uploaded videos are stored under the SHA-256 of their content
+# (uploads/<hash>.<ext>), so the same recording uploaded twice is kept once
+# and uploads with the same file name no longer overwrite each other. Next to
+# every video a sidecar <hash>.json records what was probed from it once at
+# upload time: snapshot, duration, fps, resolution, codec and frame count.
+# Analyses read the sidecar instead of probing the file again.
+#
+# An upload is written to uploads/partial/<upload id>.part as it arrives and
+# moved into place when it completes. Resumable uploads keep their partial
+# file between requests: the client appends chunks at explicit offsets and,
+# after losing the connection, asks for the current offset and continues
+# from there.
+
+
+def _fourcc(value):
+    code = int(value)
+    codec = ''.join(chr((code >> 8 * i) & 0xFF) for i in range(4)).strip('\x00 ')
+    return codec or None
+
+
+def sidecar_path(video_path):
+    return os.path.splitext(video_path)[0] + '.json'
+
+
+def probe(video_path):
+    # Metadata of a video file and its first frame as a JPEG snapshot next
+    # to it; one pass over the container header and one decoded frame
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise ValueError(f"Error opening video file: {video_path}")
+        success, frame = cap.read()
+        if not success:
+            raise ValueError("Failed to read video file")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frame_count = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        codec = _fourcc(cap.get(cv2.CAP_PROP_FOURCC))
+    finally:
+        cap.release()
+
+    stem = os.path.splitext(video_path)[0]
+    snapshot_path = f"{stem}_snapshot.jpg"
+    cv2.imwrite(snapshot_path, frame)
+    return {
+        'snapshot': os.path.basename(snapshot_path),
+        'duration': round(frame_count / fps, 3) if fps else None,
+        'fps': fps,
+        'frame_count': frame_count,
+        'width': frame.shape[1],
+        'height': frame.shape[0],
+        'codec': codec,
+    }
+
+
+class PartialUpload:
+    # File being uploaded. The content hash is computed while the chunks are
+    # written; an upload picked up again after a restart is hashed from disk
+    # when it completes.
+    def __init__(self, upload_id, path, filename, fresh):
+        self.id = upload_id
+        self.path = path
+        self.filename = filename
+        self.offset = os.path.getsize(path)
+        self.hasher = hashlib.sha256() if fresh else None
+        self.busy = False
+
+    def write(self, data):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+        self.offset += len(data)
+
+    async def receive(self, chunks):
+        # Appends an async stream of byte chunks, writing in
+        # UPLOAD_CHUNK_SIZE blocks from a worker thread so a multi-GB upload
+        # never blocks the event loop
+        buffer = bytearray()
+        async for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= config.UPLOAD_CHUNK_SIZE:
+                await asyncio.to_thread(self.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await asyncio.to_thread(self.write, bytes(buffer))
+
+    def hexdigest(self):
+        if self.hasher is None:
+            self.hasher = hashlib.sha256()
+            with open(self.path, 'rb') as f:
+                for block in iter(lambda: f.read(config.UPLOAD_CHUNK_SIZE), b''):
+                    self.hasher.update(block)
+        return self.hasher.hexdigest()
+
+    def info(self):
+        return {'upload_id': self.id, 'filename': self.filename, 'offset': self.offset}
+
+
+class VideoStore:
+    def __init__(self, root=None):
+        self.root = root or config.UPLOAD_DIR
+        self.partial_dir = os.path.join(self.root, 'partial')
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.uploads = {}
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def _partial_paths(self, upload_id):
+        base = os.path.join(self.partial_dir, upload_id)
+        return base + '.part', base + '.json'
+
+    def start(self, filename):
+        upload_id = uuid.uuid4().hex
+        filename = os.path.basename(filename or 'video.mp4')
+        path, info_path = self._partial_paths(upload_id)
+        open(path, 'wb').close()
+        with open(info_path, 'w') as f:
+            json.dump({'filename': filename}, f)
+        upload = PartialUpload(upload_id, path, filename, fresh=True)
+        with self.lock:
+            self.uploads[upload_id] = upload
+        return upload
+
+    def get(self, upload_id):
+        # Upload in progress, also one started before a restart; KeyError
+        # for an unknown ID
+        if not upload_id.isalnum():
+            raise KeyError(upload_id)
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+            if upload is not None:
+                return upload
+            path, info_path = self._partial_paths(upload_id)
+            if not os.path.isfile(path) or not os.path.isfile(info_path):
+                raise KeyError(upload_id)
+            with open(info_path) as f:
+                filename = json.load(f)['filename']
+            upload = PartialUpload(upload_id, path, filename, fresh=False)
+            self.uploads[upload_id] = upload
+            return upload
+
+    def claim(self, upload_id, offset=None):
+        # Reserve an upload for one request at a time; with an offset the
+        # client must continue exactly where the stored data ends
+        upload = self.get(upload_id)
+        with self.lock:
+            if upload.busy:
+                raise ValueError(f"Upload {upload_id} is already receiving data")
+            if offset is not None and offset != upload.offset:
+                raise ValueError(f"Upload {upload_id} continues at offset {upload.offset}, not {offset}")
+            upload.busy = True
+        return upload
+
+    def release(self, upload):
+        with self.lock:
+            upload.busy = False
+
+    def complete(self, upload):
+        # Moves a finished upload to its content address and probes it once;
+        # (video_path, metadata). Blocking: run it in a worker thread.
+        digest = upload.hexdigest()
+        ext = os.path.splitext(upload.filename)[1].lower() or '.mp4'
+        video_path = os.path.join(self.root, digest + ext)
+        with self.lock:
+            self.uploads.pop(upload.id, None)
+        info_path = self._partial_paths(upload.id)[1]
+        if os.path.isfile(video_path) and os.path.isfile(sidecar_path(video_path)):
+            logger.info(f"Upload '{upload.filename}' is already stored as {video_path}")
+            os.remove(upload.path)
+            os.remove(info_path)
+            return video_path, self.metadata(video_path)
+
+        os.replace(upload.path, video_path)
+        os.remove(info_path)
+        try:
+            metadata = probe(video_path)
+        except ValueError:
+            os.remove(video_path)
+            raise
+        metadata.update({
+            'hash': digest,
+            'filename': upload.filename,
+            'size': os.path.getsize(video_path),
+            'uploaded': time.time(),
+        })
+        with open(sidecar_path(video_path), 'w') as f:
+            json.dump(metadata, f)
+        with self.lock:
+            self.cache[video_path] = metadata
+        logger.info(f"Stored '{upload.filename}' as {video_path}: {metadata}")
+        return video_path, metadata
+
+    def discard(self, upload):
+        with self.lock:
+            self.uploads.pop(upload.id, None)
+        for path in self._partial_paths(upload.id):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def metadata(self, video_path):
+        # Sidecar record of a video; probed and written on first use for
+        # files that did not come through the store
+        with self.lock:
+            metadata = self.cache.get(video_path)
+        if metadata is not None:
+            return metadata
+        path = sidecar_path(video_path)
+        if os.path.isfile(path):
+            with open(path) as f:
+                metadata = json.load(f)
+        else:
+            metadata = probe(video_path)
+            metadata['size'] = os.path.getsize(video_path)
+            with open(path, 'w') as f:
+                json.dump(metadata, f)
+        with self.lock:
+            self.cache[video_path] = metadata
+        return metadata
+
+
+video_store = VideoStore()
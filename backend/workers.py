@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pipeline import cancel_on
+import config
+
+logger = logging.getLogger(__name__)
+
+# Bounded pool shared by every session so concurrent analyses cannot
+# oversubscribe the CPU/GPU with model calls
+inference_executor = ThreadPoolExecutor(max_workers=config.INFERENCE_WORKERS, thread_name_prefix="inference")
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def run_inference(fn, *args, **kwargs):
+    # Blocking call meant for worker threads, never for the event loop
+    return inference_executor.submit(fn, *args, **kwargs).result()
+
+
+async def iterate_in_thread(make_iterator, maxsize=None, name="session"):
+    # Drive a blocking iterator (decode -> detect -> draw -> encode) in its own
+    # thread and hand its items to the event loop through an asyncio queue.
+    # At most `maxsize` items are buffered ahead of the consumer.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    slots = threading.Semaphore(maxsize or config.STREAM_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def publish(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # Event loop already closed
+            stop.set()
+
+    def worker():
+        iterator = None
+        # Pipelines started by the iterator stop as soon as the consumer goes
+        # away, even while they wait for input that never comes
+        with cancel_on(stop):
+            try:
+                iterator = iter(make_iterator())
+                for item in iterator:
+                    while not slots.acquire(timeout=0.5):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    publish(item)
+            except Exception as e:
+                publish(_Failure(e))
+            finally:
+                # Close generators so their own cleanup (cap.release) runs here
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+                publish(_DONE)
+
+    thread = threading.Thread(target=worker, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.exc
+            slots.release()
+            yield item
+    finally:
+        # Client went away or iteration finished: let the worker exit
+        stop.set()
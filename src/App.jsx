@@ -29,8 +29,8 @@ function App() {
       }
 
       alert('Video uploaded successfully!');
-      setSnapshotUrl(`http://localhost:8000/uploads/${data.snapshot}`);
-      setVideoUrl(`http://localhost:8000/uploads/${file.name}`);
+      setSnapshotUrl(`http://localhost:8000/${data.snapshot_url}`);
+      setVideoUrl(`http://localhost:8000/${data.video_url}`);
     } catch (error) {
       console.error('Error uploading video:', error);
       alert('Failed to upload video');
@@ -139,7 +139,12 @@ function VideoSection({ snapshotUrl, videoUrl }) {
               } else if (mode === 'wrong-lane' || mode === 'wrong-lane_ip') {
                 setWrongWayCount(data.wrong_way_count);
               } else if (mode === 'speed') {
-                setVehicleData(data.vehicle_data);
+                // Only changed vehicles are sent; forgotten ones are listed in vehicles_removed
+                setVehicleData(prev => {
+                  const next = { ...prev, ...data.vehicle_data };
+                  (data.vehicles_removed || []).forEach(id => delete next[id]);
+                  return next;
+                });
               }
             } catch (parseError) {
               console.error('Error parsing JSON:', parseError);